@@ -1,12 +1,40 @@
-import requests
 import logging
-from urllib.parse import quote
+import upstream_http
+from urllib.parse import quote, urlsplit
+from circuit_breaker import get_breaker
+from deadline import DeadlineExceeded
+from stream_cache import stream_cache
 
 class AdditionalStreamServices:
     def __init__(self):
         self.timeout = 15
+        self.breaker = get_breaker('additional')
     
-    def get_ytsr_stream(self, video_id):
+    def _get_json(self, url, family, deadline=None):
+        """ホスト毎のサーキットブレーカーを通してJSONを取得（遮断中・失敗時はNone）
+
+        deadlineを使い切った場合はDeadlineExceededを送出する（呼び出し側で握りつぶさないこと）。
+        """
+        timeout = self.timeout if deadline is None else deadline.timeout(self.timeout)
+        host = urlsplit(url).netloc
+        if not self.breaker.allow(host, family):
+            return None
+        try:
+            response = upstream_http.get(url, timeout=timeout)
+            data = response.json() if response.status_code == 200 else None
+        except Exception as e:
+            self.breaker.record_failure(host, family)
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded(f"持ち時間内に取得できませんでした: {url}") from e
+            raise
+        if upstream_http.is_instance_failure(response.status_code):
+            self.breaker.record_failure(host, family)
+        else:
+            # 404などの「存在しない・再生不可」は動画側の問題なのでホストの失敗として数えない
+            self.breaker.record_success(host, family)
+        return data
+    
+    def get_ytsr_stream(self, video_id, deadline=None):
         """YTSRサービスからストリームを取得"""
         try:
             # YTSRサービスのエンドポイント（一般的なパターン）
@@ -18,21 +46,25 @@ class AdditionalStreamServices:
             
             for url in urls_to_try:
                 try:
-                    response = requests.get(url, timeout=self.timeout)
-                    if response.status_code == 200:
-                        data = response.json()
+                    data = self._get_json(url, 'ytsr', deadline)
+                    if data is not None:
                         return self._parse_ytsr_response(data, video_id)
+                except DeadlineExceeded:
+                    raise
                 except Exception as e:
                     logging.debug(f"YTSR URL {url} failed: {e}")
                     continue
             
             return None
             
+        except DeadlineExceeded:
+            # 持ち時間切れは取得元の失敗ではないので呼び出し側に任せる
+            raise
         except Exception as e:
             logging.error(f"YTSRサービスエラー: {e}")
             return None
     
-    def get_ytpl_stream(self, video_id):
+    def get_ytpl_stream(self, video_id, deadline=None):
         """YTPLサービスからストリームを取得"""
         try:
             # YTPLサービスのエンドポイント（一般的なパターン）
@@ -44,32 +76,42 @@ class AdditionalStreamServices:
             
             for url in urls_to_try:
                 try:
-                    response = requests.get(url, timeout=self.timeout)
-                    if response.status_code == 200:
-                        data = response.json()
+                    data = self._get_json(url, 'ytpl', deadline)
+                    if data is not None:
                         return self._parse_ytpl_response(data, video_id)
+                except DeadlineExceeded:
+                    raise
                 except Exception as e:
                     logging.debug(f"YTPL URL {url} failed: {e}")
                     continue
             
             return None
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logging.error(f"YTPLサービスエラー: {e}")
             return None
     
-    def get_wakame_high_quality_stream(self, video_id):
-        """高画質ストリーム取得（wakame API）"""
+    def get_wakame_high_quality_stream(self, video_id, deadline=None):
+        """高画質ストリーム取得（wakame API、URLが失効するまでは前回の結果を使う）"""
         try:
+            cached_streams = stream_cache.get('wakame', video_id)
+            if cached_streams is not None:
+                return cached_streams
+            
             url = f"https://watawatawata.glitch.me/api/{video_id}?token=wakameoishi"
-            response = requests.get(url, timeout=self.timeout)
+            data = self._get_json(url, 'wakame', deadline)
             
-            if response.status_code == 200:
-                data = response.json()
-                return self._parse_wakame_response(data, video_id)
+            if data is not None:
+                stream_data = self._parse_wakame_response(data, video_id)
+                stream_cache.set('wakame', video_id, stream_data)
+                return stream_data
             
             return None
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logging.error(f"Wakame高画質サービスエラー: {e}")
             return None
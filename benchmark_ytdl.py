@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+yt-dlp抽出のベンチマーク
+
+使い方:
+  python benchmark_ytdl.py extraction [--runs N] VIDEO_ID [VIDEO_ID ...]
+  python benchmark_ytdl.py startup [--runs N]
+  python benchmark_ytdl.py first-call [--runs N] VIDEO_ID [VIDEO_ID ...]
+
+extraction: 従来の「動画用と音声用で2回抽出」と現在の「1回の抽出」を比較する（キャッシュとプロセスプールは使わない）。
+startup: ytdl_serviceの読み込み時間を、yt_dlpを起動時に読み込んでいた場合と比較する。
+first-call: 最初の抽出（yt_dlpの読み込みを含む）と、毎回YoutubeDLを作る場合・プールを使い回す場合の
+2回目以降の抽出時間を比較する。
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+_BASE_OPTIONS = {'quiet': True, 'no_warnings': True, 'noplaylist': True}
+
+
+def _watch_url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def _two_extractions(video_id):
+    """従来の方式: フォーマット一覧の抽出とbestaudioの抽出を別々に実行"""
+    import yt_dlp
+    with yt_dlp.YoutubeDL({**_BASE_OPTIONS, 'format': 'best[height<=1080]/best'}) as ydl:
+        ydl.extract_info(_watch_url(video_id), download=False)
+    with yt_dlp.YoutubeDL({**_BASE_OPTIONS, 'format': 'bestaudio[ext=m4a]/bestaudio'}) as ydl:
+        ydl.extract_info(_watch_url(video_id), download=False)
+
+
+def _fresh_extraction(video_id):
+    """従来の方式: 抽出の度にYoutubeDLを作る"""
+    import yt_dlp
+    with yt_dlp.YoutubeDL({**_BASE_OPTIONS, 'format': 'best[height<=1080]/best'}) as ydl:
+        ydl.extract_info(_watch_url(video_id), download=False)
+
+
+def _measure(fn, runs):
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started_at)
+    return timings
+
+
+def _time_subprocess(code):
+    started_at = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.perf_counter() - started_at
+
+
+def bench_extraction(args):
+    from ytdl_extractor import extract_stream_data
+
+    for video_id in args.video_ids:
+        before = _measure(lambda: _two_extractions(video_id), args.runs)
+        after = _measure(lambda: extract_stream_data(video_id), args.runs)
+        before_median = statistics.median(before)
+        after_median = statistics.median(after)
+        print(f"{video_id}: 2回抽出 {before_median:.2f}秒 → 1回抽出 {after_median:.2f}秒 "
+              f"({after_median / before_median:.0%})")
+
+
+def bench_startup(args):
+    # 新しいプロセスで読み込むので、ファイルシステムのキャッシュ以外は毎回冷えた状態になる
+    eager = statistics.median(_time_subprocess('import ytdl_service, yt_dlp') for _ in range(args.runs))
+    lazy = statistics.median(_time_subprocess('import ytdl_service') for _ in range(args.runs))
+    print(f"ytdl_serviceの読み込み: yt_dlpを同時に読み込む {eager:.2f}秒 → 遅延読み込み {lazy:.2f}秒")
+
+
+def bench_first_call(args):
+    from ytdl_extractor import extract_stream_data, ytdl_pool
+
+    started_at = time.perf_counter()
+    extract_stream_data(args.video_ids[0])
+    print(f"最初の抽出（yt_dlpの読み込みを含む）: {time.perf_counter() - started_at:.2f}秒")
+
+    for video_id in args.video_ids:
+        fresh = statistics.median(_measure(lambda: _fresh_extraction(video_id), args.runs))
+        pooled = statistics.median(_measure(lambda: extract_stream_data(video_id), args.runs))
+        print(f"{video_id}: 毎回YoutubeDLを作る {fresh:.2f}秒 → プールを使い回す {pooled:.2f}秒")
+    print(f"プール: {ytdl_pool.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='yt-dlp抽出のベンチマーク')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    extraction = subparsers.add_parser('extraction')
+    extraction.add_argument('video_ids', nargs='+')
+    extraction.add_argument('--runs', type=int, default=3)
+    extraction.set_defaults(func=bench_extraction)
+
+    startup = subparsers.add_parser('startup')
+    startup.add_argument('--runs', type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+
+    first_call = subparsers.add_parser('first-call')
+    first_call.add_argument('video_ids', nargs='+')
+    first_call.add_argument('--runs', type=int, default=3)
+    first_call.set_defaults(func=bench_first_call)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+キャッシュポリシー - エンドポイント系統毎の有効期間とキャッシュキーの正規化
+"""
+import unicodedata
+from urllib.parse import urlencode
+from config import CACHE_TTL_POLICY, RESPONSE_CACHE_TTL
+
+# 系統毎の既定パラメータ（キーから除外しても結果が変わらないもの）
+DEFAULT_PARAMS = {
+    'search': {'page': '1', 'sort_by': 'relevance'},
+    'channels': {'page': '1', 'sort_by': 'newest'},
+    'comments': {},
+    'trending': {},
+    'videos': {},
+}
+
+
+def endpoint_family(endpoint):
+    """'videos/abc' → 'videos' のように系統名を返す"""
+    parts = endpoint.strip('/').split('/')
+    if parts[:2] == ['api', 'v1']:
+        parts = parts[2:]
+    return parts[0] if parts else ''
+
+
+def ttl_for(endpoint):
+    """エンドポイントのキャッシュ有効期間（秒）"""
+    return CACHE_TTL_POLICY.get(endpoint_family(endpoint), RESPONSE_CACHE_TTL)
+
+
+def normalize_text(value):
+    """NFKC正規化と空白の統一（全角スペース・連続空白を半角1つに）"""
+    return ' '.join(unicodedata.normalize('NFKC', value).split())
+
+
+def canonical_params(endpoint, params):
+    """正規化したパラメータをキー順に並べて返す（空値と既定値は除外）"""
+    if not params:
+        return []
+    defaults = DEFAULT_PARAMS.get(endpoint_family(endpoint), {})
+    canonical = []
+    for key, value in params.items():
+        if value is None or value == '':
+            continue
+        value = normalize_text(value) if isinstance(value, str) else str(value)
+        if defaults.get(key) == value:
+            continue
+        canonical.append((key, value))
+    canonical.sort()
+    return canonical
+
+
+def make_cache_key(endpoint, params):
+    """同じ結果になるリクエストが同じキーになるようにキャッシュキーを作る"""
+    query = urlencode(canonical_params(endpoint, params))
+    return f"{endpoint.strip('/')}?{query}" if query else endpoint.strip('/')
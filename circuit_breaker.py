@@ -0,0 +1,160 @@
+"""
+サーキットブレーカー - インスタンス×エンドポイント系統毎に closed / open / half-open を管理する
+"""
+import random
+import threading
+import time
+from collections import deque
+from config import (
+    BREAKER_WINDOW, BREAKER_MIN_REQUESTS, BREAKER_ERROR_RATE, BREAKER_CONSECUTIVE_FAILURES,
+    BREAKER_BASE_OPEN, BREAKER_MAX_OPEN, BREAKER_HALF_OPEN_PROBES
+)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 半開状態で取った試行枠が返却されない場合（キャンセル等）に解放するまでの秒数
+_PROBE_SLOT_TIMEOUT = 30
+
+
+class _Circuit:
+    def __init__(self):
+        self.state = CLOSED
+        self.outcomes = deque()  # (時刻, 成功したか)
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probes = deque()  # 半開状態で通したリクエストの開始時刻
+
+
+class CircuitBreaker:
+    def __init__(self, name, window=BREAKER_WINDOW, min_requests=BREAKER_MIN_REQUESTS,
+                 error_rate=BREAKER_ERROR_RATE, consecutive_failures=BREAKER_CONSECUTIVE_FAILURES,
+                 base_open=BREAKER_BASE_OPEN, max_open=BREAKER_MAX_OPEN,
+                 half_open_probes=BREAKER_HALF_OPEN_PROBES):
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.consecutive_failures = consecutive_failures
+        self.base_open = base_open
+        self.max_open = max_open
+        self.half_open_probes = half_open_probes
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def _circuit(self, instance, family):
+        key = (instance, family)
+        circuit = self._circuits.get(key)
+        if circuit is None:
+            circuit = self._circuits[key] = _Circuit()
+        return circuit
+
+    def allow(self, instance, family=''):
+        """リクエストを通してよいか（半開状態では試行枠を1つ消費する）"""
+        now = time.time()
+        with self._lock:
+            circuit = self._circuit(instance, family)
+            if circuit.state == CLOSED:
+                return True
+            if circuit.state == OPEN:
+                if now < circuit.open_until:
+                    return False
+                circuit.state = HALF_OPEN
+                circuit.probes.clear()
+            while circuit.probes and now - circuit.probes[0] > _PROBE_SLOT_TIMEOUT:
+                circuit.probes.popleft()
+            if len(circuit.probes) >= self.half_open_probes:
+                return False
+            circuit.probes.append(now)
+            return True
+
+    def record_success(self, instance, family=''):
+        now = time.time()
+        with self._lock:
+            circuit = self._circuit(instance, family)
+            if circuit.state == HALF_OPEN:
+                # 試行が成功したので通常状態に戻す
+                circuit.state = CLOSED
+                circuit.trips = 0
+                circuit.outcomes.clear()
+                circuit.probes.clear()
+            circuit.consecutive_failures = 0
+            self._add_outcome(circuit, now, True)
+
+    def record_failure(self, instance, family=''):
+        now = time.time()
+        with self._lock:
+            circuit = self._circuit(instance, family)
+            circuit.consecutive_failures += 1
+            if circuit.state == HALF_OPEN:
+                # 試行が失敗したので遮断時間を延ばして再び遮断
+                self._trip(circuit, now)
+                return
+            if circuit.state == OPEN:
+                return
+            self._add_outcome(circuit, now, False)
+            total = len(circuit.outcomes)
+            failures = sum(1 for _, ok in circuit.outcomes if not ok)
+            if ((total >= self.min_requests and failures / total >= self.error_rate)
+                    or circuit.consecutive_failures >= self.consecutive_failures):
+                self._trip(circuit, now)
+
+    def _add_outcome(self, circuit, now, ok):
+        circuit.outcomes.append((now, ok))
+        while circuit.outcomes and now - circuit.outcomes[0][0] > self.window:
+            circuit.outcomes.popleft()
+
+    def _trip(self, circuit, now):
+        """遮断（連続して遮断されるたびに時間を倍にし、揺らぎを加える）"""
+        duration = min(self.max_open, self.base_open * (2 ** circuit.trips))
+        circuit.state = OPEN
+        circuit.open_until = now + duration * random.uniform(0.8, 1.2)
+        circuit.trips += 1
+        circuit.outcomes.clear()
+        circuit.probes.clear()
+
+    def state(self, instance, family=''):
+        with self._lock:
+            circuit = self._circuits.get((instance, family))
+            if circuit is None:
+                return CLOSED
+            if circuit.state == OPEN and time.time() >= circuit.open_until:
+                return HALF_OPEN
+            return circuit.state
+
+    def snapshot(self):
+        """遮断中・半開状態の回路（確認API用）"""
+        now = time.time()
+        with self._lock:
+            result = {}
+            for (instance, family), circuit in self._circuits.items():
+                if circuit.state == CLOSED:
+                    continue
+                result[f"{instance} [{family}]"] = {
+                    'state': circuit.state,
+                    'trips': circuit.trips,
+                    'open_for': round(max(0.0, circuit.open_until - now), 1)
+                }
+            return {
+                'tracked': len(self._circuits),
+                'not_closed': result
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """名前付きの共有ブレーカーを取得"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def all_breakers():
+    with _breakers_lock:
+        return dict(_breakers)
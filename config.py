@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 # Invidious インスタンスリスト（優先順位付き）
 INVIDIOUS_INSTANCES = [
@@ -65,6 +66,117 @@ INVIDIOUS_INSTANCES = [
 # リクエストタイムアウト設定
 REQUEST_TIMEOUT = 10
 
+# ルート全体の持ち時間（秒）。フォールバックの連鎖はこの残り時間の中で実行する
+# gunicornの既定のワーカータイムアウト（30秒）より短くする
+WATCH_DEADLINE = float(os.environ.get('WATCH_DEADLINE', 25))
+STREAM_API_DEADLINE = float(os.environ.get('STREAM_API_DEADLINE', 20))
+STREAM_BATCH_MAX_IDS = int(os.environ.get('STREAM_BATCH_MAX_IDS', 10))  # /api/streamsで1回に解決する動画数の上限
+FAN_OUT_WORKERS = int(os.environ.get('FAN_OUT_WORKERS', 16))  # 独立した上流呼び出しを並列実行するスレッド数
+STREAM_RACE_DELAY = float(os.environ.get('STREAM_RACE_DELAY', 1.0))  # ストリーム取得元を追加で走らせるまでの待ち時間（秒）
+STREAM_RACE_WORKERS = int(os.environ.get('STREAM_RACE_WORKERS', 16))  # ストリーム取得元の競争用スレッド数
+
+# レスポンスキャッシュ設定（LRU＋TTL、ワーカー内の全サービスで共有）
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))  # 既定の有効期間（秒）
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 2000))  # 最大エントリ数
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # 最大サイズ（バイト）
+
+# エンドポイント系統毎のキャッシュ有効期間（秒）。ここにない系統はRESPONSE_CACHE_TTL
+CACHE_TTL_POLICY = {
+    'videos': int(os.environ.get('CACHE_TTL_VIDEOS', 3600)),  # ストリームURLは数時間有効
+    'search': int(os.environ.get('CACHE_TTL_SEARCH', 600)),
+    'trending': int(os.environ.get('CACHE_TTL_TRENDING', 300)),  # 数分毎に変わる
+    'channels': int(os.environ.get('CACHE_TTL_CHANNELS', 3600)),  # ほとんど変わらない
+    'comments': int(os.environ.get('CACHE_TTL_COMMENTS', 1800)),
+}
+
+# stale-while-revalidate設定（期限切れの値を即座に返し、裏で1件だけ更新する）
+SWR_ENDPOINTS = ('trending', 'search')  # 対象エンドポイント
+SWR_MAX_STALE = int(os.environ.get('SWR_MAX_STALE', 1800))  # 期限切れ後も即座に返す上限（秒）
+STALE_IF_ERROR = os.environ.get('STALE_IF_ERROR', '1') == '1'  # 全インスタンス失敗時に古い値を返す
+STALE_IF_ERROR_MAX_STALE = int(os.environ.get('STALE_IF_ERROR_MAX_STALE', 21600))  # 失敗時に返す古い値の上限（秒）
+SWR_REFRESH_WORKERS = int(os.environ.get('SWR_REFRESH_WORKERS', 4))  # バックグラウンド更新のスレッド数
+
+# ワーカー間共有キャッシュ設定（SQLite WALをL2として使用）
+SHARED_CACHE_ENABLED = os.environ.get('SHARED_CACHE_ENABLED', '1') == '1'
+SHARED_CACHE_PATH = os.environ.get('SHARED_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'response_cache.sqlite3'))
+SHARED_CACHE_MAX_ENTRIES = int(os.environ.get('SHARED_CACHE_MAX_ENTRIES', 20000))  # L2の最大エントリ数
+SHARED_CACHE_FILL_WAIT = float(os.environ.get('SHARED_CACHE_FILL_WAIT', 5))  # 他ワーカーの取得完了を待つ最大時間（秒）
+
+# 解決済みストリームURLのキャッシュ設定（有効期間は署名付きURLのexpireから決める）
+STREAM_CACHE_MAX_ENTRIES = int(os.environ.get('STREAM_CACHE_MAX_ENTRIES', 2000))
+STREAM_CACHE_MAX_BYTES = int(os.environ.get('STREAM_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+STREAM_CACHE_SAFETY_MARGIN = int(os.environ.get('STREAM_CACHE_SAFETY_MARGIN', 300))  # expireの何秒前に捨てるか（動画の長さも加える）
+STREAM_CACHE_DEFAULT_TTL = int(os.environ.get('STREAM_CACHE_DEFAULT_TTL', 300))  # expireのないURLの有効期間（秒）
+STREAM_CACHE_MAX_TTL = int(os.environ.get('STREAM_CACHE_MAX_TTL', 6 * 3600))  # 有効期間の上限（秒）
+
+# ネガティブキャッシュ設定（存在しない・再生できない動画/チャンネルを種別毎の期間だけ記録）
+NEGATIVE_CACHE_TTLS = {
+    'not_found': int(os.environ.get('NEGATIVE_TTL_NOT_FOUND', 3600)),  # 削除済み・存在しない
+    'unplayable': int(os.environ.get('NEGATIVE_TTL_UNPLAYABLE', 900)),  # 非公開・地域制限など
+}
+NEGATIVE_CACHE_CONFIRMATIONS = int(os.environ.get('NEGATIVE_CACHE_CONFIRMATIONS', 2))  # 記録に必要な一致回答数
+NEGATIVE_CACHE_MAX_ENTRIES = int(os.environ.get('NEGATIVE_CACHE_MAX_ENTRIES', 10000))
+
+# ショート動画フィード設定（セッション毎に組み立てて保存し、カーソルで返す）
+SHORTS_FEED_TTL = int(os.environ.get('SHORTS_FEED_TTL', 1800))  # 最後に使われてから破棄するまでの秒数
+SHORTS_FEED_MAX_FEEDS = int(os.environ.get('SHORTS_FEED_MAX_FEEDS', 500))  # 保存するフィード数の上限
+SHORTS_FEED_MAX_VIDEOS = int(os.environ.get('SHORTS_FEED_MAX_VIDEOS', 300))  # 1フィードの動画数の上限
+SHORTS_FEED_PAGE_SIZE = int(os.environ.get('SHORTS_FEED_PAGE_SIZE', 20))  # 1ページの件数
+SHORTS_FEED_INITIAL_QUERIES = int(os.environ.get('SHORTS_FEED_INITIAL_QUERIES', 12))  # 最初に並列で実行する検索数
+SHORTS_FEED_REFILL_QUERIES = int(os.environ.get('SHORTS_FEED_REFILL_QUERIES', 8))  # 1回の補充で実行する検索数
+SHORTS_FEED_REFILL_THRESHOLD = int(os.environ.get('SHORTS_FEED_REFILL_THRESHOLD', 10))  # 残りがこの件数以下で裏で補充
+SHORTS_FEED_BUILD_DEADLINE = float(os.environ.get('SHORTS_FEED_BUILD_DEADLINE', 10))  # 1回の組み立て・補充の持ち時間（秒）
+
+# ヘッジリクエスト設定（応答が遅い場合に次のインスタンスへ並列で投げる）
+HEDGE_FANOUT = int(os.environ.get('HEDGE_FANOUT', 3))  # 同時に投げる最大インスタンス数（1で逐次）
+HEDGE_DELAY = float(os.environ.get('HEDGE_DELAY', 0.5))  # 次のインスタンスへ投げるまでの待ち時間（秒）
+HEDGE_DEADLINE = float(os.environ.get('HEDGE_DEADLINE', 15))  # 1リクエスト全体の制限時間（秒）
+HEDGE_MAX_WORKERS = int(os.environ.get('HEDGE_MAX_WORKERS', 16))  # ヘッジ用スレッドプールの大きさ
+
+# 上流HTTP接続プール設定（gunicornのスレッド数＋ヘッジ分を目安に調整）
+UPSTREAM_POOL_HOSTS = int(os.environ.get('UPSTREAM_POOL_HOSTS', 64))  # 保持するホスト毎プールの数
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 16))  # ホスト毎のkeep-alive接続数
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 3.05))  # TCP/TLS接続タイムアウト（秒）
+UPSTREAM_CONNECT_RETRIES = int(os.environ.get('UPSTREAM_CONNECT_RETRIES', 1))  # 接続失敗時のみ再試行する回数
+
+# インスタンススケジューラ設定（レイテンシと成功率のEWMAで順位付け）
+SCHEDULER_EWMA_ALPHA = float(os.environ.get('SCHEDULER_EWMA_ALPHA', 0.3))  # 新しい観測値の重み
+SCHEDULER_EXPLORATION_RATE = float(os.environ.get('SCHEDULER_EXPLORATION_RATE', 0.1))  # 下位インスタンスを試す確率
+SCHEDULER_FAILURE_COOLDOWN = float(os.environ.get('SCHEDULER_FAILURE_COOLDOWN', 180))  # 失敗直後に後回しにする時間（秒）
+
+# サーキットブレーカー設定（インスタンス×エンドポイント系統毎）
+BREAKER_WINDOW = float(os.environ.get('BREAKER_WINDOW', 60))  # エラー率を計算する時間窓（秒）
+BREAKER_MIN_REQUESTS = int(os.environ.get('BREAKER_MIN_REQUESTS', 4))  # 判定に必要な最小リクエスト数
+BREAKER_ERROR_RATE = float(os.environ.get('BREAKER_ERROR_RATE', 0.5))  # 遮断するエラー率
+BREAKER_CONSECUTIVE_FAILURES = int(os.environ.get('BREAKER_CONSECUTIVE_FAILURES', 3))  # 連続失敗でも遮断
+BREAKER_BASE_OPEN = float(os.environ.get('BREAKER_BASE_OPEN', 15))  # 初回の遮断時間（秒）、失敗が続くと倍増
+BREAKER_MAX_OPEN = float(os.environ.get('BREAKER_MAX_OPEN', 600))  # 遮断時間の上限（秒）
+BREAKER_HALF_OPEN_PROBES = int(os.environ.get('BREAKER_HALF_OPEN_PROBES', 1))  # 半開状態で通す同時リクエスト数
+
+# レートリミット設定（インスタンス毎のトークンバケット、429で補充速度を半減して徐々に戻す）
+RATE_LIMIT_RATE = float(os.environ.get('RATE_LIMIT_RATE', 2.0))  # 1秒あたりの補充トークン数
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 5))  # バケットの容量（連続で送れる数）
+RATE_LIMIT_MIN_RATE = float(os.environ.get('RATE_LIMIT_MIN_RATE', 0.2))  # 429が続いたときの下限
+RATE_LIMIT_RECOVERY = float(os.environ.get('RATE_LIMIT_RECOVERY', 0.05))  # 成功1回で戻す補充速度
+RATE_LIMIT_DEFAULT_RETRY_AFTER = float(os.environ.get('RATE_LIMIT_DEFAULT_RETRY_AFTER', 10))  # Retry-Afterがない429の停止秒数
+RATE_LIMIT_MAX_RETRY_AFTER = float(os.environ.get('RATE_LIMIT_MAX_RETRY_AFTER', 300))  # 停止秒数の上限
+
+# ウォームスナップショット設定（インスタンスのスコアとよく使うキャッシュを保存し、再起動直後から使う）
+WARM_SNAPSHOT_ENABLED = os.environ.get('WARM_SNAPSHOT_ENABLED', '1') == '1'
+WARM_SNAPSHOT_PATH = os.environ.get('WARM_SNAPSHOT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'warm_snapshot.json.gz'))
+WARM_SNAPSHOT_INTERVAL = float(os.environ.get('WARM_SNAPSHOT_INTERVAL', 300))  # 定期保存の間隔（秒）
+WARM_SNAPSHOT_MAX_AGE = float(os.environ.get('WARM_SNAPSHOT_MAX_AGE', 3600))  # これより古いスコアは読み込まない（秒）
+WARM_SNAPSHOT_FAMILIES = ('trending', 'search', 'videos')  # 保存するキャッシュのエンドポイント系統
+WARM_SNAPSHOT_MAX_ENTRIES = int(os.environ.get('WARM_SNAPSHOT_MAX_ENTRIES', 300))  # 保存するキャッシュの最大件数
+
+# インスタンス死活監視設定（gunicornワーカーのうち1つだけが実行）
+PROBE_ENABLED = os.environ.get('PROBE_ENABLED', '1') == '1'
+PROBE_INTERVAL = float(os.environ.get('PROBE_INTERVAL', 120))  # 監視間隔（秒）
+PROBE_CONCURRENCY = int(os.environ.get('PROBE_CONCURRENCY', 16))  # 同時に監視するインスタンス数
+PROBE_TIMEOUT = float(os.environ.get('PROBE_TIMEOUT', 2.5))  # 1インスタンスあたりのタイムアウト（秒）
+PROBE_LOCK_PATH = os.environ.get('PROBE_LOCK_PATH', os.path.join(tempfile.gettempdir(), 'instance_probe.lock'))
+PROBE_RESULTS_PATH = os.environ.get('PROBE_RESULTS_PATH', os.path.join(tempfile.gettempdir(), 'instance_probe.json'))
+
 # yt-dlp設定
 YTDL_OPTIONS = {
     'quiet': True,
@@ -72,3 +184,15 @@ YTDL_OPTIONS = {
     'extract_flat': False,
     'format': 'best[ext=mp4]/best',
 }
+YTDL_POOL_SIZE = int(os.environ.get('YTDL_POOL_SIZE', 4))  # フォーマット指定毎に使い回すYoutubeDLの最大数
+YTDL_POOL_MAX_USES = int(os.environ.get('YTDL_POOL_MAX_USES', 200))  # この回数使ったYoutubeDLは作り直す
+
+# yt-dlp抽出用プロセスプール設定（抽出はCPU負荷が高いため、リクエスト処理のGILを塞がないよう別プロセスで実行）
+YTDL_EXTRACT_WORKERS = int(os.environ.get('YTDL_EXTRACT_WORKERS', 2))  # ワーカーあたりの抽出プロセス数
+YTDL_EXTRACT_QUEUE_SIZE = int(os.environ.get('YTDL_EXTRACT_QUEUE_SIZE', 16))  # 待ち行列の上限（超えた分は即座に断る）
+YTDL_EXTRACT_TIMEOUT = float(os.environ.get('YTDL_EXTRACT_TIMEOUT', 60))  # 1件の抽出の上限（秒）。超えたらプロセスごと止める
+YTDL_EXTRACT_MAX_JOBS = int(os.environ.get('YTDL_EXTRACT_MAX_JOBS', 100))  # この件数を処理したプロセスは作り直す
+
+# Node常駐ワーカー設定（turbo_video_service.jsを起動したままにして1行1件のJSONでやり取り）
+TURBO_NODE_WORKERS = int(os.environ.get('TURBO_NODE_WORKERS', 2))  # ワーカーあたりのNodeプロセス数
+TURBO_NODE_RESTART_DELAY = float(os.environ.get('TURBO_NODE_RESTART_DELAY', 2.0))  # 落ちたプロセスを起動し直すまでの間隔（秒）
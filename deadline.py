@@ -0,0 +1,31 @@
+"""
+リクエスト期限 - ルートで作成し、フォールバックの連鎖全体で残り時間を共有する
+"""
+import time
+from hedged_request import HedgeAbort
+
+
+class DeadlineExceeded(HedgeAbort):
+    """リクエスト全体の持ち時間を使い切った（ヘッジ中なら残りの候補を中断）"""
+
+
+class Deadline:
+    # これより短い残り時間では新しい上流呼び出しを始めない
+    MIN_HOP_TIMEOUT = 0.5
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() < self.MIN_HOP_TIMEOUT
+
+    def timeout(self, cap=None):
+        """次の呼び出しに割り当てるタイムアウト（残り時間とcapの小さい方、使い切っていれば送出）"""
+        remaining = self.remaining()
+        if remaining < self.MIN_HOP_TIMEOUT:
+            raise DeadlineExceeded(f"リクエストの持ち時間 {self.budget}秒 を使い切りました")
+        return remaining if cap is None else min(cap, remaining)
@@ -0,0 +1,56 @@
+"""
+並列実行ヘルパー - 独立した上流呼び出しをまとめて並列に実行し、失敗は呼び出し毎に切り離す
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from config import FAN_OUT_WORKERS
+from deadline import DeadlineExceeded
+
+_executor = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS, thread_name_prefix='fan-out')
+_local = threading.local()
+
+
+def _run_in_worker(fn):
+    _local.inside = True
+    try:
+        return fn()
+    finally:
+        _local.inside = False
+
+
+def gather(calls, deadline=None, timeout=None):
+    """calls（{名前: 引数なし関数}）を並列に実行し、({名前: 結果}, {名前: 例外}) を返す
+
+    1つの失敗は他の結果に影響しない。deadline（またはtimeout秒）までに終わらなかった呼び出しは
+    取り消してDeadlineExceededとして返す。並列実行中のスレッドから呼ばれた場合は
+    プールの枯渇を避けるため順番に実行する。
+    """
+    results = {}
+    errors = {}
+    if len(calls) <= 1 or getattr(_local, 'inside', False):
+        for name, fn in calls.items():
+            try:
+                results[name] = fn()
+            except Exception as e:
+                errors[name] = e
+        return results, errors
+
+    futures = {_executor.submit(_run_in_worker, fn): name for name, fn in calls.items()}
+    if deadline is not None:
+        timeout = deadline.remaining() if timeout is None else min(timeout, deadline.remaining())
+    done, pending = wait(futures, timeout=timeout)
+
+    for future in done:
+        name = futures[future]
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            errors[name] = e
+    for future in pending:
+        future.cancel()
+        errors[futures[future]] = DeadlineExceeded(f"並列実行が時間内に終わりませんでした: {futures[future]}")
+
+    for name, error in errors.items():
+        logging.warning(f"並列呼び出し {name} が失敗: {error}")
+    return results, errors
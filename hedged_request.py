@@ -0,0 +1,85 @@
+"""
+ヘッジ付き並列リクエスト - 上位インスタンスから段階的に並列実行し最初の成功を採用
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import HEDGE_FANOUT, HEDGE_DELAY, HEDGE_DEADLINE, HEDGE_MAX_WORKERS
+
+_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix='hedge')
+
+
+class HedgeAbort(Exception):
+    """fetchが送出すると残りの候補を試さずにそのまま呼び出し元へ送出される"""
+
+
+class HedgedRequestError(Exception):
+    """すべての候補が失敗、または制限時間を超過した"""
+
+    def __init__(self, message, last_error=None):
+        super().__init__(message)
+        self.last_error = last_error
+
+
+def hedged_call(candidates, fetch, fanout=HEDGE_FANOUT, hedge_delay=HEDGE_DELAY, deadline=HEDGE_DEADLINE,
+                executor=None):
+    """候補を順位順に投げ、応答がなければhedge_delay毎に次の候補を追加する
+
+    fetch(candidate, timeout) は成功時に結果を返し、失敗時は例外を送出すること。
+    HedgeAbortを送出した場合は残りの候補を試さずに中断する。
+    戻り値は (成功した候補, 結果)。残りのリクエストはキャンセルまたは無視される。
+    fetchの中でさらにhedged_callを使う場合は、プールの枯渇を避けるため別のexecutorを渡す。
+    """
+    executor = executor or _executor
+    remaining_candidates = iter(candidates)
+    end_time = time.monotonic() + deadline
+    in_flight = {}
+    last_error = None
+
+    def launch():
+        candidate = next(remaining_candidates, None)
+        if candidate is None:
+            return False
+        timeout = max(0.1, end_time - time.monotonic())
+        in_flight[executor.submit(fetch, candidate, timeout)] = candidate
+        return True
+
+    has_more = launch()
+    try:
+        while in_flight:
+            remaining = end_time - time.monotonic()
+            if remaining <= 0:
+                break
+
+            can_hedge = has_more and len(in_flight) < max(1, fanout)
+            wait_time = min(hedge_delay, remaining) if can_hedge else remaining
+            done, _ = wait(in_flight, timeout=wait_time, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # 応答がないので次の候補を追加で投げる
+                if can_hedge:
+                    has_more = launch()
+                continue
+
+            for future in done:
+                candidate = in_flight.pop(future)
+                try:
+                    return candidate, future.result()
+                except HedgeAbort:
+                    raise
+                except Exception as e:
+                    last_error = e
+
+            # 失敗した分だけ次の候補ですぐに補充
+            for _ in done:
+                if not has_more or len(in_flight) >= max(1, fanout):
+                    break
+                has_more = launch()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+    if in_flight:
+        logging.warning(f"ヘッジリクエストが制限時間 {deadline}秒 を超過しました")
+        raise HedgedRequestError("制限時間を超過しました", last_error)
+    raise HedgedRequestError("すべての候補で失敗しました", last_error)
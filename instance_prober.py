@@ -0,0 +1,180 @@
+"""
+インスタンス死活監視 - 軽量エンドポイントを定期的に叩いてスケジューラの順位に反映
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import upstream_http
+from instance_scheduler import classify_error
+from config import (
+    PROBE_INTERVAL, PROBE_CONCURRENCY, PROBE_TIMEOUT,
+    PROBE_LOCK_PATH, PROBE_RESULTS_PATH
+)
+
+
+class InstanceProber:
+    """監視はロックを取れた1ワーカーだけが行い、結果はファイル経由で他のワーカーと共有する"""
+
+    def __init__(self, targets, interval=PROBE_INTERVAL, concurrency=PROBE_CONCURRENCY,
+                 timeout=PROBE_TIMEOUT, lock_path=PROBE_LOCK_PATH, results_path=PROBE_RESULTS_PATH):
+        # targets: {名前: (スケジューラ, 監視パス)}
+        self.targets = targets
+        self.interval = interval
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.lock_path = lock_path
+        self.results_path = results_path
+        self.is_leader = False
+        self.last_probe = None
+        self._lock_file = None
+        self._applied_at = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _try_become_leader(self):
+        """ファイルロックで監視担当ワーカーを1つに絞る"""
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.is_leader = True
+        logging.info(f"インスタンス監視を担当します (pid={os.getpid()})")
+        return True
+
+    def _probe_instance(self, instance, path):
+        started_at = time.monotonic()
+        try:
+            response = upstream_http.get(f"{instance.rstrip('/')}/{path}", timeout=self.timeout)
+            upstream_http.raise_for_status(response)
+            return {'ok': True, 'latency': time.monotonic() - started_at}
+        except Exception as e:
+            return {'ok': False, 'error': classify_error(e)}
+
+    def _apply_result(self, scheduler, instance, result):
+        if result['ok']:
+            scheduler.record_success(instance, result['latency'])
+        else:
+            scheduler.record_failure(instance, result['error'])
+
+    def probe_once(self):
+        """全インスタンスを1回監視し、結果をスケジューラと共有ファイルに反映"""
+        started_at = time.time()
+        results = {name: {} for name in self.targets}
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='probe') as executor:
+            futures = {}
+            for name, (scheduler, path) in self.targets.items():
+                for instance in scheduler.instances:
+                    futures[executor.submit(self._probe_instance, instance, path)] = (name, instance)
+            # 完了したものから順に反映（起動直後の待ち時間を短くするため）
+            for future in as_completed(futures):
+                name, instance = futures[future]
+                result = future.result()
+                results[name][instance] = result
+                self._apply_result(self.targets[name][0], instance, result)
+
+        self._write_results(started_at, results)
+        alive = sum(1 for by_name in results.values() for r in by_name.values() if r['ok'])
+        self.last_probe = {
+            'at': started_at,
+            'duration': round(time.time() - started_at, 3),
+            'alive': alive,
+            'total': len(futures)
+        }
+        logging.info(f"インスタンス監視完了: {alive}/{len(futures)} 稼働中")
+
+    def _write_results(self, probed_at, results):
+        tmp_path = f"{self.results_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'at': probed_at, 'results': results}, f)
+            os.replace(tmp_path, self.results_path)
+            self._applied_at = probed_at
+        except OSError as e:
+            logging.warning(f"監視結果の保存に失敗: {e}")
+
+    def _load_results(self):
+        """他のワーカーが書いた監視結果を読み込む（新しいものだけ反映）"""
+        try:
+            with open(self.results_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        probed_at = data.get('at', 0)
+        if probed_at <= self._applied_at or time.time() - probed_at > self.interval * 2:
+            return False
+
+        for name, by_instance in data.get('results', {}).items():
+            if name not in self.targets:
+                continue
+            scheduler = self.targets[name][0]
+            for instance, result in by_instance.items():
+                self._apply_result(scheduler, instance, result)
+        self._applied_at = probed_at
+        self.last_probe = {'at': probed_at, 'loaded_from': self.results_path}
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                if self._try_become_leader():
+                    self.probe_once()
+                else:
+                    self._load_results()
+            except Exception as e:
+                logging.warning(f"インスタンス監視エラー: {e}")
+
+            # 担当外のワーカーは共有ファイルを短い間隔で確認する
+            wait = self.interval if self.is_leader else min(self.interval, 15)
+            if self._stop.wait(wait):
+                break
+
+    def start(self):
+        """前回保存された監視結果があれば反映し、監視スレッドを開始する（初回の監視は待たない）
+
+        読み込みを止めないよう、保存結果がなければ設定順のまま起動し、初回の監視結果は届き次第反映する。
+        """
+        if self._thread is not None:
+            return
+        self._load_results()
+        self._try_become_leader()
+        self._thread = threading.Thread(target=self._run, name='instance-prober', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        return {
+            'leader': self.is_leader,
+            'pid': os.getpid(),
+            'interval': self.interval,
+            'last_probe': self.last_probe
+        }
+
+
+_prober = None
+_prober_lock = threading.Lock()
+
+
+def start_prober(targets):
+    """プロセスで1つの監視を開始"""
+    global _prober
+    with _prober_lock:
+        if _prober is None:
+            _prober = InstanceProber(targets)
+            _prober.start()
+        return _prober
+
+
+def get_prober():
+    return _prober
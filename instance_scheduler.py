@@ -0,0 +1,203 @@
+"""
+インスタンススケジューラ - レイテンシと成功率のEWMAで上流インスタンスの試行順を決める
+"""
+import random
+import threading
+import time
+from collections import deque
+import requests
+from upstream_http import UpstreamHTTPError
+from config import SCHEDULER_EWMA_ALPHA, SCHEDULER_EXPLORATION_RATE, SCHEDULER_FAILURE_COOLDOWN
+
+# 未計測インスタンスの初期値（設定順を保つため楽観的に置く）
+_PRIOR_LATENCY = 1.0
+_PRIOR_SUCCESS_RATE = 0.7
+
+
+def normalize_instance(url):
+    """インスタンスURLを正規化（末尾スラッシュ・大文字小文字の揺れを吸収）"""
+    return url.strip().rstrip('/').lower() + '/'
+
+
+def dedupe_instances(instances):
+    """重複インスタンスを除去（最初に出現した順位を採用）"""
+    seen = set()
+    unique = []
+    for url in instances:
+        normalized = normalize_instance(url)
+        if normalized not in seen:
+            seen.add(normalized)
+            unique.append(normalized)
+    return unique
+
+
+def classify_error(error):
+    """例外をエラー種別に分類"""
+    if isinstance(error, UpstreamHTTPError):
+        if error.status_code == 429:
+            return 'http_429'
+        if error.status_code >= 500:
+            return 'http_5xx'
+        return 'http_4xx'
+    if isinstance(error, requests.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.ConnectionError):
+        return 'connection'
+    if isinstance(error, ValueError):
+        return 'invalid_json'
+    return 'other'
+
+
+class InstanceStats:
+    """インスタンス毎の観測値"""
+
+    def __init__(self, index):
+        self.index = index
+        self.ewma_latency = None
+        self.success_rate = None
+        self.successes = 0
+        self.failures = 0
+        self.picks = 0
+        self.last_failure = 0.0
+        self.recent_errors = deque(maxlen=5)
+
+    def score(self):
+        """1回成功するまでの期待時間（小さいほど優先）"""
+        latency = self.ewma_latency if self.ewma_latency is not None else _PRIOR_LATENCY
+        success_rate = self.success_rate if self.success_rate is not None else _PRIOR_SUCCESS_RATE
+        # 同点時は設定ファイルの順位を優先
+        return latency / max(success_rate, 0.05) + self.index * 0.001
+
+    def to_dict(self):
+        return {
+            'score': round(self.score(), 3),
+            'ewma_latency': round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+            'success_rate': round(self.success_rate, 3) if self.success_rate is not None else None,
+            'successes': self.successes,
+            'failures': self.failures,
+            'picks': self.picks,
+            'last_failure': self.last_failure or None,
+            'recent_errors': list(self.recent_errors)
+        }
+
+
+class InstanceScheduler:
+    def __init__(self, instances, alpha=SCHEDULER_EWMA_ALPHA,
+                 exploration_rate=SCHEDULER_EXPLORATION_RATE,
+                 failure_cooldown=SCHEDULER_FAILURE_COOLDOWN):
+        self.instances = dedupe_instances(instances)
+        self.alpha = alpha
+        self.exploration_rate = exploration_rate
+        self.failure_cooldown = failure_cooldown
+        self._stats = {url: InstanceStats(i) for i, url in enumerate(self.instances)}
+        self._last_order = []
+        self._lock = threading.Lock()
+
+    def _update(self, current, value):
+        if current is None:
+            return value
+        return (1 - self.alpha) * current + self.alpha * value
+
+    def record_success(self, instance, latency):
+        """成功を記録"""
+        stats = self._stats.get(normalize_instance(instance))
+        if stats is None:
+            return
+        with self._lock:
+            stats.successes += 1
+            stats.ewma_latency = self._update(stats.ewma_latency, latency)
+            stats.success_rate = self._update(stats.success_rate, 1.0)
+
+    def record_failure(self, instance, error):
+        """失敗を記録（errorは例外またはエラー種別の文字列）"""
+        stats = self._stats.get(normalize_instance(instance))
+        if stats is None:
+            return
+        error_type = error if isinstance(error, str) else classify_error(error)
+        now = time.time()
+        with self._lock:
+            stats.failures += 1
+            stats.success_rate = self._update(stats.success_rate, 0.0)
+            stats.last_failure = now
+            stats.recent_errors.append({'type': error_type, 'at': now})
+
+    def order(self):
+        """今回の試行順を返す（直近に失敗したインスタンスは後回し）"""
+        now = time.time()
+        with self._lock:
+            ranked = sorted(self.instances, key=lambda url: self._stats[url].score())
+            healthy = [url for url in ranked if now - self._stats[url].last_failure >= self.failure_cooldown]
+            cooling = [url for url in ranked if now - self._stats[url].last_failure < self.failure_cooldown]
+
+            # 探索: 一定確率で下位のインスタンスを2番目に入れて回復を確認する
+            explore_pool = healthy[3:] + cooling
+            if explore_pool and random.random() < self.exploration_rate:
+                explored = random.choice(explore_pool)
+                if explored in healthy:
+                    healthy.remove(explored)
+                else:
+                    cooling.remove(explored)
+                healthy.insert(min(1, len(healthy)), explored)
+
+            order = healthy + cooling
+            if order:
+                self._stats[order[0]].picks += 1
+            self._last_order = order[:5]
+            return order
+
+    def export_state(self):
+        """再起動後に引き継ぐ観測値"""
+        with self._lock:
+            return {
+                url: {
+                    'ewma_latency': stats.ewma_latency,
+                    'success_rate': stats.success_rate,
+                    'successes': stats.successes,
+                    'failures': stats.failures,
+                    'last_failure': stats.last_failure
+                }
+                for url, stats in self._stats.items()
+                if stats.successes or stats.failures
+            }
+
+    def import_state(self, state):
+        """export_state()の値を復元（起動後にすでに観測したインスタンスは上書きしない）"""
+        restored = 0
+        with self._lock:
+            for url, values in state.items():
+                stats = self._stats.get(normalize_instance(url))
+                if stats is None or stats.successes or stats.failures:
+                    continue
+                stats.ewma_latency = values.get('ewma_latency')
+                stats.success_rate = values.get('success_rate')
+                stats.successes = values.get('successes', 0)
+                stats.failures = values.get('failures', 0)
+                stats.last_failure = values.get('last_failure', 0.0)
+                restored += 1
+        return restored
+
+    def snapshot(self):
+        """スコアと直近の試行順（確認API用）"""
+        with self._lock:
+            ranked = sorted(self.instances, key=lambda url: self._stats[url].score())
+            return {
+                'last_order': list(self._last_order),
+                'instances': {url: self._stats[url].to_dict() for url in ranked}
+            }
+
+
+# サービス間で共有するスケジューラ
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name, instances):
+    """名前付きの共有スケジューラを取得"""
+    with _schedulers_lock:
+        if name not in _schedulers:
+            _schedulers[name] = InstanceScheduler(instances)
+        return _schedulers[name]
+
+
+def all_schedulers():
+    return dict(_schedulers)
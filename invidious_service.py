@@ -1,59 +1,258 @@
-import requests
 import logging
+import threading
 import time
 from functools import lru_cache
-from config import INVIDIOUS_INSTANCES, REQUEST_TIMEOUT
+from config import (
+    INVIDIOUS_INSTANCES, REQUEST_TIMEOUT,
+    HEDGE_FANOUT, HEDGE_DELAY, HEDGE_DEADLINE, SHARED_CACHE_FILL_WAIT,
+    SWR_ENDPOINTS, SWR_MAX_STALE, STALE_IF_ERROR, STALE_IF_ERROR_MAX_STALE, SWR_REFRESH_WORKERS,
+    NEGATIVE_CACHE_CONFIRMATIONS
+)
+from hedged_request import hedged_call, HedgedRequestError
+from instance_scheduler import InstanceScheduler, get_scheduler
+from response_cache import ResponseCache, shared_response_cache
+from single_flight import SingleFlight, get_single_flight
+from negative_cache import negative_cache, classify_unavailable, UnavailableError
+from cache_policy import canonical_params, make_cache_key, ttl_for, endpoint_family
+from circuit_breaker import CircuitBreaker, get_breaker
+from deadline import DeadlineExceeded
+from rate_limiter import RateLimiter, get_rate_limiter
+from fan_out import gather
+from payload_projection import project_payload
+from stream_cache import StreamCache, stream_cache
+import json_codec
+import upstream_http
 import random
+from concurrent.futures import ThreadPoolExecutor
+
+# 期限切れキャッシュのバックグラウンド更新用
+_refresh_executor = ThreadPoolExecutor(max_workers=SWR_REFRESH_WORKERS, thread_name_prefix='swr-refresh')
+
+
+class _Answers:
+    """ヘッジ中の各インスタンスの失敗回答を数える（複数スレッドから記録される）"""
 
-class InvidiousService:
     def __init__(self):
-        self.instances = INVIDIOUS_INSTANCES.copy()
-        # 優先インスタンスを使用するため、シャッフルしない
-        self._cache = {}
-        self._cache_timeout = 300  # 5分間キャッシュ
-        self._failed_instances = {}  # 失敗したインスタンスを一時的に記録
-        self._failure_timeout = 180  # 3分間は失敗したインスタンスを避ける
+        self.failed = 0
+        self.unavailable = []
+        self._lock = threading.Lock()
+
+    def record_failure(self, reason=None):
+        """失敗を記録し、これまでの「利用不可」の回答数を返す"""
+        with self._lock:
+            self.failed += 1
+            if reason:
+                self.unavailable.append(reason)
+            return len(self.unavailable)
+
+    def all_unavailable(self):
+        """失敗がすべて「利用不可」の回答なら最後の理由を返す（ネットワークエラーが混じればNone）"""
+        with self._lock:
+            if self.unavailable and len(self.unavailable) == self.failed:
+                return self.unavailable[-1]
+            return None
+
+
+class InvidiousService:
+    def __init__(self, instances=None, cache=None, hedge_fanout=HEDGE_FANOUT,
+                 hedge_delay=HEDGE_DELAY, hedge_deadline=HEDGE_DEADLINE):
+        # インスタンスの試行順はレイテンシと成功率からスケジューラが決める
+        # 既定の構成ではスケジューラとキャッシュをワーカー内の全インスタンスで共有
+        if instances:
+            self.scheduler = InstanceScheduler(instances)
+            self._cache = cache or ResponseCache()
+            self._flight = SingleFlight('invidious')
+            self.breaker = CircuitBreaker('invidious')
+            self.limiter = RateLimiter('invidious')
+            self._streams = StreamCache()
+        else:
+            self.scheduler = get_scheduler('invidious', INVIDIOUS_INSTANCES)
+            self._cache = cache or shared_response_cache
+            self._flight = get_single_flight('invidious')
+            self.breaker = get_breaker('invidious')
+            self.limiter = get_rate_limiter('invidious')
+            self._streams = stream_cache
+        self.instances = self.scheduler.instances
+        # ヘッジリクエスト設定（fanout=1で従来どおりの逐次試行）
+        self.hedge_fanout = hedge_fanout
+        self.hedge_delay = hedge_delay
+        self.hedge_deadline = hedge_deadline
     
-    def _make_request(self, endpoint, params=None):
-        """複数のインスタンスでリクエストを試行（キャッシュ付き）"""
-        # キャッシュキーを作成
-        cache_key = f"{endpoint}:{str(params) if params else ''}"
-        current_time = time.time()
+    def _make_request(self, endpoint, params=None, deadline=None):
+        """複数のインスタンスでリクエストを試行（キャッシュ付き、deadlineの残り時間内で打ち切る）"""
+        # パラメータを正規化してキャッシュキーを作成（並び順・全角空白・既定値の違いを吸収）
+        params = dict(canonical_params(endpoint, params)) or None
+        cache_key = make_cache_key(endpoint, params)
         
         # キャッシュチェック
-        if cache_key in self._cache:
-            cached_data, timestamp = self._cache[cache_key]
-            if current_time - timestamp < self._cache_timeout:
+        cached_data = self._cache.get(cache_key)
+        if cached_data is not None:
+            return cached_data
+        
+        # 存在しない・再生できないと分かっている動画/チャンネルは上流に問い合わせない
+        negative_key = self._negative_key(endpoint)
+        if negative_key:
+            negative_cache.check(*negative_key)
+        
+        # トレンド・検索は期限切れの値をすぐに返し、裏で1件だけ更新する
+        allow_stale = self._allows_stale(endpoint)
+        if allow_stale:
+            stale = self._cache.get_stale(cache_key, SWR_MAX_STALE)
+            if stale is not None:
+                self._refresh_in_background(cache_key, endpoint, params)
+                return stale[0]
+        
+        # 同じキーの同時ミスは1回の取得にまとめる
+        try:
+            return self._flight.do(cache_key, lambda: self._fetch_and_store(cache_key, endpoint, params, deadline=deadline),
+                                   deadline=deadline)
+        except Exception:
+            # 全インスタンスが失敗している間は最後に成功した値を返す
+            if allow_stale and STALE_IF_ERROR:
+                stale = self._cache.get_stale(cache_key, STALE_IF_ERROR_MAX_STALE)
+                if stale is not None:
+                    logging.warning(f"上流が失敗したため古いキャッシュを返します: {cache_key} (期限切れから{int(stale[1])}秒)")
+                    return stale[0]
+            raise
+    
+    def _allows_stale(self, endpoint):
+        return endpoint_family(endpoint) in SWR_ENDPOINTS
+    
+    def _negative_key(self, endpoint):
+        """ネガティブキャッシュの対象なら (scope, id) を返す
+
+        チャンネルは channels/<id> 本体のみ（videos・playlists等の一覧が空・404でもチャンネル自体は記録しない）。
+        """
+        parts = endpoint.strip('/').split('/')
+        if len(parts) >= 2 and parts[0] == 'videos':
+            return 'video', parts[1]
+        if len(parts) == 2 and parts[0] == 'channels':
+            return 'channel', parts[1]
+        return None
+    
+    def _fetch_and_store(self, cache_key, endpoint, params, background=False, deadline=None):
+        """上流から取得してキャッシュに保存"""
+        # リクエスト全体の残り時間をヘッジの制限時間にする
+        hedge_deadline = self.hedge_deadline if deadline is None else deadline.timeout(self.hedge_deadline)
+        
+        # 他のワーカーが同じキーを取得中なら、その結果が共有キャッシュに入るのを待つ
+        filling = self._cache.begin_fill(cache_key, hedge_deadline)
+        if not filling:
+            if background:
+                return None
+            cached_data = self._cache.wait_for_fill(cache_key, min(SHARED_CACHE_FILL_WAIT, hedge_deadline))
+            if cached_data is not None:
                 return cached_data
+            if deadline is not None:
+                hedge_deadline = deadline.timeout(self.hedge_deadline)
         
-        # キャッシュがない場合はAPIリクエスト
-        for instance in self.instances:
-            # 失敗したインスタンスを一時的に避ける
-            if instance in self._failed_instances:
-                failure_time = self._failed_instances[instance]
-                if current_time - failure_time < self._failure_timeout:
-                    continue
-                else:
-                    # タイムアウト経過後は再試行
-                    del self._failed_instances[instance]
-            
+        # 上位のインスタンスから段階的に並列実行（送信枠のないインスタンスと遮断中の回路は飛ばす）
+        negative_key = self._negative_key(endpoint)
+        answers = _Answers()
+        family = endpoint_family(endpoint)
+        candidates = (instance for instance in self.scheduler.order()
+                      if self._acquire(instance, family))
+        try:
+            _, data = hedged_call(
+                candidates,
+                lambda instance, timeout: self._fetch_from_instance(
+                    instance, endpoint, params, timeout, answers if negative_key else None),
+                fanout=self.hedge_fanout,
+                hedge_delay=self.hedge_delay,
+                deadline=hedge_deadline
+            )
+        except UnavailableError as e:
+            negative_cache.record(e.scope, e.item_id, e.reason)
+            raise
+        except HedgedRequestError as e:
+            # 応答したインスタンスがすべて「利用不可」と答えた場合も記録（ネットワークエラーが混じれば記録しない）
+            reason = answers.all_unavailable() if negative_key else None
+            if reason:
+                negative_cache.record(*negative_key, reason)
+                raise UnavailableError(*negative_key, reason) from e
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded(f"持ち時間内に取得できませんでした: {endpoint}") from e
+            raise Exception("すべてのInvidiousインスタンスで失敗しました") from e
+        else:
+            # エンドポイント系統毎の有効期間で保存（SWR対象は期限切れ後もしばらく保持）
+            # 取得中の印は保存の後に外す（待機中のワーカーが値も印もない瞬間を見て上流へ行かないように）
+            stale_ttl = 0
+            if self._allows_stale(endpoint):
+                stale_ttl = max(SWR_MAX_STALE, STALE_IF_ERROR_MAX_STALE if STALE_IF_ERROR else 0)
+            self._cache.set(cache_key, data, ttl=ttl_for(endpoint), stale_ttl=stale_ttl)
+        finally:
+            if filling:
+                self._cache.end_fill(cache_key)
+        return data
+    
+    def _refresh_in_background(self, cache_key, endpoint, params):
+        """期限切れキャッシュをバックグラウンドで更新（キー毎に同時1件まで）"""
+        if not self._cache.begin_refresh(cache_key):
+            return
+        
+        def refresh():
             try:
-                url = f"{instance.rstrip('/')}/api/v1/{endpoint}"
-                response = requests.get(url, params=params, timeout=REQUEST_TIMEOUT)
-                if response.status_code == 200:
-                    data = response.json()
-                    # キャッシュに保存
-                    self._cache[cache_key] = (data, current_time)
-                    return data
-                else:
-                    # HTTPエラーも記録
-                    self._failed_instances[instance] = current_time
+                self._fetch_and_store(cache_key, endpoint, params, background=True)
             except Exception as e:
-                logging.warning(f"インスタンス {instance} でエラー: {e}")
-                self._failed_instances[instance] = current_time
-                continue
+                logging.warning(f"バックグラウンド更新に失敗: {cache_key}: {e}")
+            finally:
+                self._cache.end_refresh(cache_key)
         
-        raise Exception("すべてのInvidiousインスタンスで失敗しました")
+        try:
+            _refresh_executor.submit(refresh)
+        except RuntimeError:
+            self._cache.end_refresh(cache_key)
+    
+    def _fetch_from_instance(self, instance, endpoint, params, timeout, answers=None):
+        """単一インスタンスへのリクエスト（結果をスケジューラとブレーカーに記録）
+
+        answersを渡すと「存在しない/再生不可」の回答を数え、規定数そろった時点で
+        UnavailableErrorを送出して残りのインスタンスへの問い合わせを打ち切る。
+        """
+        family = endpoint_family(endpoint)
+        started_at = time.monotonic()
+        try:
+            url = f"{instance.rstrip('/')}/api/v1/{endpoint}"
+            response = upstream_http.get(url, params=params, timeout=min(REQUEST_TIMEOUT, timeout))
+            # 使うフィールドだけを残してからキャッシュに入れる
+            data = project_payload(endpoint, json_codec.loads(upstream_http.raise_for_status(response).content))
+        except Exception as e:
+            reason = classify_unavailable(e)
+            if reason:
+                # 動画側の問題なのでインスタンスの失敗としては数えない
+                logging.info(f"インスタンス {instance} の回答: {e}")
+                self._record_outcome(instance, family, time.monotonic() - started_at)
+            else:
+                logging.warning(f"インスタンス {instance} でエラー: {e}")
+                self._record_outcome(instance, family, time.monotonic() - started_at, e)
+            if answers is not None:
+                unavailable_count = answers.record_failure(reason)
+                if reason and unavailable_count >= NEGATIVE_CACHE_CONFIRMATIONS:
+                    raise UnavailableError(*self._negative_key(endpoint), reason) from e
+            raise
+        self._record_outcome(instance, family, time.monotonic() - started_at)
+        return data
+    
+    def _acquire(self, instance, family):
+        """レートリミットとサーキットブレーカーの両方が許せば送信する（ブレーカーが断ればトークンは返す）"""
+        if not self.limiter.try_acquire(instance):
+            return False
+        if not self.breaker.allow(instance, family):
+            self.limiter.release(instance)
+            return False
+        return True
+    
+    def _record_outcome(self, instance, family, latency, error=None):
+        """スケジューラ・サーキットブレーカー・レートリミッターに結果を記録"""
+        if error is None:
+            self.scheduler.record_success(instance, latency)
+            self.breaker.record_success(instance, family)
+            self.limiter.record_success(instance)
+        else:
+            self.scheduler.record_failure(instance, error)
+            self.breaker.record_failure(instance, family)
+            if getattr(error, 'status_code', None) == 429:
+                self.limiter.record_throttled(instance, error.retry_after)
     
     def search_videos(self, query, page=1, sort_by='relevance'):
         """動画検索"""
@@ -95,14 +294,18 @@ class InvidiousService:
             logging.error(f"統合検索エラー: {e}")
             return {'videos': [], 'channels': []}
     
-    def get_video_info(self, video_id):
+    def get_video_info(self, video_id, deadline=None):
         """動画情報取得"""
         try:
-            return self._make_request(f'videos/{video_id}')
+            return self._make_request(f'videos/{video_id}', deadline=deadline)
         except Exception as e:
             logging.error(f"動画情報取得エラー: {e}")
             return None
     
+    def peek_video_info(self, video_id):
+        """キャッシュ済みの動画情報だけを返す（上流には問い合わせない）"""
+        return self._cache.get(make_cache_key(f'videos/{video_id}', None))
+    
     def get_video_formats(self, video_id):
         """動画フォーマット取得"""
         try:
@@ -114,10 +317,19 @@ class InvidiousService:
             logging.error(f"フォーマット取得エラー: {e}")
             return []
     
-    def get_stream_urls(self, video_id):
-        """Invidiousから直接ストリームURLを取得"""
+    def get_stream_urls(self, video_id, deadline=None):
+        """Invidiousから直接ストリームURLを取得（URLが失効するまでは解決済みの結果を使う）"""
+        cached_streams = self._streams.get('invidious', video_id)
+        if cached_streams is not None:
+            return cached_streams
+        stream_data = self._build_stream_urls(video_id, deadline)
+        self._streams.set('invidious', video_id, stream_data)
+        return stream_data
+    
+    def _build_stream_urls(self, video_id, deadline=None):
+        """動画情報からフォーマット一覧を組み立てる"""
         try:
-            video_info = self.get_video_info(video_id)
+            video_info = self.get_video_info(video_id, deadline=deadline)
             if not video_info:
                 return None
             
@@ -232,124 +444,95 @@ class InvidiousService:
             logging.error(f"Invidiousストリーム取得エラー: {e}")
             return None
     
-    def get_channel_info(self, channel_id):
+    def get_channel_info(self, channel_id, deadline=None):
         """チャンネル情報を取得"""
         try:
-            endpoint = f"api/v1/channels/{channel_id}"
-            
-            # 各インスタンスで試行
-            for instance in self.instances:
-                try:
-                    url = f"{instance}{endpoint}"
-                    response = requests.get(url, timeout=10)
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        return {
-                            'author': data.get('author', ''),
-                            'authorId': data.get('authorId', channel_id),
-                            'description': data.get('description', ''),
-                            'subCount': data.get('subCount', 0),
-                            'totalViews': data.get('totalViews', 0),
-                            'videoCount': data.get('videoCount', 0),
-                            'joined': data.get('joined', 0),
-                            'authorThumbnails': data.get('authorThumbnails', []),
-                            'authorBanners': data.get('authorBanners', []),
-                            'autoGenerated': data.get('autoGenerated', False)
-                        }
-                except requests.RequestException as e:
-                    logging.warning(f"チャンネル情報取得失敗 {instance}: {e}")
-                    continue
-                    
-            logging.error(f"全てのインスタンスでチャンネル情報取得に失敗: {channel_id}")
-            return None
-            
+            data = self._make_request(f'channels/{channel_id}', deadline=deadline)
+            if not data:
+                return None
+            return {
+                'author': data.get('author', ''),
+                'authorId': data.get('authorId', channel_id),
+                'description': data.get('description', ''),
+                'subCount': data.get('subCount', 0),
+                'totalViews': data.get('totalViews', 0),
+                'videoCount': data.get('videoCount', 0),
+                'joined': data.get('joined', 0),
+                'authorThumbnails': data.get('authorThumbnails', []),
+                'authorBanners': data.get('authorBanners', []),
+                'autoGenerated': data.get('autoGenerated', False)
+            }
         except Exception as e:
             logging.error(f"チャンネル情報取得エラー: {str(e)}")
             return None
     
-    def get_channel_videos(self, channel_id, page=1, sort='newest'):
+    def get_channel_videos(self, channel_id, page=1, sort='newest', deadline=None):
         """チャンネルの動画一覧を取得"""
         try:
-            endpoint = f"/api/v1/channels/{channel_id}/videos"
+            endpoint = f"channels/{channel_id}/videos"
             params = {
                 'page': page,
                 'sort_by': sort
             }
-            data = self._make_request(endpoint, params)
+            data = self._make_request(endpoint, params, deadline=deadline)
             
-            if data:
-                videos = []
-                for video in data:
-                    videos.append({
-                        'videoId': video.get('videoId', ''),
-                        'title': video.get('title', ''),
-                        'description': video.get('description', ''),
-                        'videoThumbnails': video.get('videoThumbnails', []),
-                        'lengthSeconds': video.get('lengthSeconds', 0),
-                        'viewCount': video.get('viewCount', 0),
-                        'author': video.get('author', ''),
-                        'authorId': video.get('authorId', ''),
-                        'publishedText': video.get('publishedText', ''),
-                        'published': video.get('published', 0)
-                    })
-                return videos
+            # 新しいInvidiousは {"videos": [...], "continuation": ...} を返す
+            # （各項目は取得時に一覧用のフィールドへ射影済み）
+            if isinstance(data, dict):
+                data = data.get('videos', [])
+            return list(data or [])
         except Exception as e:
             logging.error(f"チャンネル動画取得エラー: {str(e)}")
             return []
+    
+    def get_channel_page(self, channel_id, page=1, sort='newest', deadline=None):
+        """チャンネル情報と動画一覧を (info, videos) で取得
+
+        最初のページ（新しい順）は両方をまとめてチャンネル単位でキャッシュし、
+        再訪問時は上流に問い合わせない。
+        """
+        first_page = page == 1 and sort == 'newest'
+        cache_key = make_cache_key(f'channel_page/{channel_id}', None)
+        if first_page:
+            cached_page = self._cache.get(cache_key)
+            if cached_page is not None:
+                return cached_page['info'], cached_page['videos']
+        
+        # 情報と動画一覧は独立しているので並列に取得
+        results, _ = gather({
+            'info': lambda: self.get_channel_info(channel_id, deadline=deadline),
+            'videos': lambda: self.get_channel_videos(channel_id, page=page, sort=sort, deadline=deadline)
+        }, deadline=deadline)
+        info, videos = results.get('info'), results.get('videos') or []
+        # 片方でも取れなかった場合は次回に再取得する
+        if first_page and info and videos:
+            self._cache.set(cache_key, {'info': info, 'videos': videos}, ttl=ttl_for('channels'))
+        return info, videos
 
     def get_trending_videos(self, region='JP'):
         """トレンド動画を取得（件数を増加）"""
         try:
-            # 通常のトレンド動画を取得
+            # 通常のトレンド動画と追加のカテゴリを並列に取得（失敗したカテゴリだけ欠ける）
             endpoint = "trending"
-            params = {'region': region}
-            data = self._make_request(endpoint, params)
+            categories = [('default', 30), ('Music', 10), ('Gaming', 10)]
+            calls = {}
+            for category, _ in categories:
+                params = {'region': region}
+                if category != 'default':
+                    params['type'] = category
+                calls[category] = lambda params=params: self._make_request(endpoint, params)
+            results, _ = gather(calls)
             
+            # 各項目は取得時に一覧用のフィールドへ射影済み
             all_videos = []
-            if data:
-                for video in data[:30]:  # 30件に増加
-                    all_videos.append({
-                        'videoId': video.get('videoId', ''),
-                        'title': video.get('title', ''),
-                        'description': video.get('description', ''),
-                        'videoThumbnails': video.get('videoThumbnails', []),
-                        'lengthSeconds': video.get('lengthSeconds', 0),
-                        'viewCount': video.get('viewCount', 0),
-                        'author': video.get('author', ''),
-                        'authorId': video.get('authorId', ''),
-                        'publishedText': video.get('publishedText', ''),
-                        'published': video.get('published', 0)
-                    })
-            
-            # 追加のカテゴリからも取得
-            try:
-                for category in ['Music', 'Gaming']:
-                    cat_params = {'region': region, 'type': category}
-                    cat_data = self._make_request(endpoint, cat_params)
-                    if cat_data:
-                        for video in cat_data[:10]:
-                            all_videos.append({
-                                'videoId': video.get('videoId', ''),
-                                'title': video.get('title', ''),
-                                'description': video.get('description', ''),
-                                'videoThumbnails': video.get('videoThumbnails', []),
-                                'lengthSeconds': video.get('lengthSeconds', 0),
-                                'viewCount': video.get('viewCount', 0),
-                                'author': video.get('author', ''),
-                                'authorId': video.get('authorId', ''),
-                                'publishedText': video.get('publishedText', ''),
-                                'published': video.get('published', 0)
-                            })
-            except:
-                pass
-                
+            for category, limit in categories:
+                all_videos.extend((results.get(category) or [])[:limit])
             return all_videos
         except Exception as e:
             logging.error(f"トレンド動画取得エラー: {str(e)}")
             return []
 
-    def get_video_comments(self, video_id, continuation=None):
+    def get_video_comments(self, video_id, continuation=None, deadline=None):
         """動画のコメントを取得"""
         try:
             endpoint = f"comments/{video_id}"
@@ -357,7 +540,7 @@ class InvidiousService:
             if continuation:
                 params['continuation'] = continuation
                 
-            data = self._make_request(endpoint, params)
+            data = self._make_request(endpoint, params, deadline=deadline)
             
             if data:
                 comments = []
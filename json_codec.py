@@ -0,0 +1,23 @@
+"""
+JSONの読み書き - orjsonがあれば使い、なければ標準のjsonにフォールバックする
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """bytesまたはstrをデコード"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value):
+    """UTF-8のままのコンパクトなJSON文字列にエンコード"""
+    if orjson is not None:
+        return orjson.dumps(value).decode('utf-8')
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
@@ -0,0 +1,115 @@
+"""
+ネガティブキャッシュ - 存在しない・再生できない動画/チャンネルを種別毎の期間だけ記録する
+
+ネットワークエラーやインスタンス側のブロックは記録しない（不安定なインスタンスが正常な動画を
+ブラックリストに入れないため）。
+"""
+import threading
+import time
+from collections import OrderedDict
+from upstream_http import UpstreamHTTPError
+from hedged_request import HedgeAbort
+from config import NEGATIVE_CACHE_TTLS, NEGATIVE_CACHE_MAX_ENTRIES
+
+# 動画自体が再生できないことを示すメッセージ
+_UNPLAYABLE_PATTERNS = (
+    'private', 'unavailable', 'not available', 'removed', 'does not exist',
+    'no longer', 'terminated', 'copyright', 'members-only', 'age-restricted',
+    '非公開', '利用できません', '削除'
+)
+# インスタンスや抽出側の問題を示すメッセージ（動画の状態とは無関係）
+_INSTANCE_PROBLEM_PATTERNS = (
+    'not a bot', 'blocked', 'captcha', 'rate limit', 'ratelimit', 'too many requests',
+    'try again later', 'timed out', 'proxy'
+)
+
+
+def classify_unavailable_message(message):
+    """エラーメッセージが動画の再生不可を示していれば 'unplayable' を返す"""
+    if not message:
+        return None
+    text = message.lower()
+    if any(pattern in text for pattern in _INSTANCE_PROBLEM_PATTERNS):
+        return None
+    if any(pattern in text for pattern in _UNPLAYABLE_PATTERNS):
+        return 'unplayable'
+    return None
+
+
+def classify_unavailable(error):
+    """上流の回答が確定的な「存在しない/再生不可」なら種別を返す（ネットワークエラー等はNone）"""
+    if not isinstance(error, UpstreamHTTPError):
+        return None
+    if error.status_code in (404, 410):
+        return 'not_found'
+    if error.status_code == 429:
+        return None
+    return classify_unavailable_message(error.detail)
+
+
+class UnavailableError(HedgeAbort):
+    """動画・チャンネルが存在しない、または再生できない（ヘッジ中なら残りの候補を中断）"""
+
+    def __init__(self, scope, item_id, reason):
+        super().__init__(f"{scope} {item_id} は利用できません ({reason})")
+        self.scope = scope
+        self.item_id = item_id
+        self.reason = reason
+
+
+class NegativeCache:
+    def __init__(self, ttls=None, max_entries=NEGATIVE_CACHE_MAX_ENTRIES):
+        self.ttls = dict(NEGATIVE_CACHE_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (scope, id) -> (reason, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.recorded = {}
+
+    def record(self, scope, item_id, reason):
+        """scope（'video' / 'channel'）とIDに対して失敗理由を記録"""
+        ttl = self.ttls.get(reason)
+        if not ttl:
+            return
+        with self._lock:
+            key = (scope, item_id)
+            self._entries.pop(key, None)
+            self._entries[key] = (reason, time.time() + ttl)
+            self.recorded[reason] = self.recorded.get(reason, 0) + 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, scope, item_id):
+        """記録中の失敗理由を返す（なければNone）"""
+        with self._lock:
+            entry = self._entries.get((scope, item_id))
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[(scope, item_id)]
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def check(self, scope, item_id):
+        """記録中ならUnavailableErrorを送出"""
+        reason = self.get(scope, item_id)
+        if reason:
+            raise UnavailableError(scope, item_id, reason)
+
+    def clear(self, scope, item_id):
+        with self._lock:
+            self._entries.pop((scope, item_id), None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'recorded': dict(self.recorded),
+                'ttls': dict(self.ttls)
+            }
+
+
+# ワーカー内で共有するネガティブキャッシュ
+negative_cache = NegativeCache()
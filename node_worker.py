@@ -0,0 +1,205 @@
+"""
+Node常駐ワーカー - Nodeのスクリプトを起動したままにし、1行1件のJSONで呼び出す
+
+呼び出し毎のNode起動とモジュール読み込みを省き、スクリプト側のメモリ内キャッシュも生かしたままにする。
+1つのプロセスで複数の呼び出しをidで区別して同時に処理する。プロセスが落ちた場合は処理中の呼び出しを
+失敗させ、次の呼び出しで起動し直す。
+"""
+import atexit
+import itertools
+import logging
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import json_codec
+from config import TURBO_NODE_RESTART_DELAY, SCHEDULER_EWMA_ALPHA
+
+
+class NodeWorkerError(Exception):
+    """ワーカーがエラーを返した、または起動・通信できなかった"""
+
+
+class NodeWorkerTimeout(NodeWorkerError):
+    """制限時間内に応答がなかった"""
+
+
+class NodeWorker:
+    """Nodeプロセス1つ（落ちたら作り直さず、プールが新しいものと入れ替える）"""
+
+    def __init__(self, name, script):
+        self.name = name
+        try:
+            self.process = subprocess.Popen(
+                ['node', script, 'worker'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=None
+            )
+        except OSError as e:
+            raise NodeWorkerError(f"{name} を起動できませんでした: {e}")
+        self._ids = itertools.count(1)
+        self._pending = {}  # id -> Future
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        threading.Thread(target=self._read_loop, name=f"{name}-reader", daemon=True).start()
+
+    @property
+    def alive(self):
+        return not self._closed and self.process.poll() is None
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def call(self, method, params, timeout):
+        request_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise NodeWorkerError(f"{self.name} は終了しています")
+            self._pending[request_id] = future
+        line = json_codec.dumps({'id': request_id, 'method': method, 'params': params}) + '\n'
+        try:
+            with self._write_lock:
+                self.process.stdin.write(line.encode('utf-8'))
+                self.process.stdin.flush()
+        except OSError as e:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise NodeWorkerError(f"{self.name} に送信できませんでした: {e}")
+
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # 遅れて届いた応答は読み取り側で捨てる
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise NodeWorkerTimeout(f"{self.name} が {timeout}秒以内に応答しませんでした: {method}")
+
+    def _read_loop(self):
+        try:
+            for line in self.process.stdout:
+                try:
+                    message = json_codec.loads(line)
+                except ValueError:
+                    logging.warning(f"{self.name} から解釈できない出力: {line[:200]!r}")
+                    continue
+                if not isinstance(message, dict):
+                    # 依存モジュールが標準出力に書いた数値・文字列・配列などは応答ではない
+                    logging.warning(f"{self.name} から応答でない出力: {line[:200]!r}")
+                    continue
+                with self._lock:
+                    future = self._pending.pop(message.get('id'), None)
+                if future is None:
+                    continue
+                if message.get('error') is not None:
+                    future.set_exception(NodeWorkerError(message['error']))
+                else:
+                    future.set_result(message.get('result'))
+        except Exception as e:
+            # 読み取りが止まると応答を受け取れないので、プロセスを止めてプールに作り直させる
+            logging.error(f"{self.name} の出力を読み取れなくなりました: {e!r}")
+            self.process.kill()
+
+        exitcode = self.process.wait()
+        with self._lock:
+            self._closed = True
+            pending, self._pending = self._pending, {}
+        if pending:
+            logging.warning(f"{self.name} が終了しました（終了コード {exitcode}）。処理中の {len(pending)}件 を失敗にします")
+        for future in pending.values():
+            future.set_exception(NodeWorkerError(f"{self.name} が終了しました（終了コード {exitcode}）"))
+
+    def stop(self):
+        with self._lock:
+            self._closed = True
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=2)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+class NodeWorkerPool:
+    def __init__(self, name, script, size, restart_delay=TURBO_NODE_RESTART_DELAY, alpha=SCHEDULER_EWMA_ALPHA):
+        self.name = name
+        self.script = script
+        self.size = max(1, size)
+        self.restart_delay = restart_delay
+        self.alpha = alpha
+        self._workers = [None] * self.size
+        self._next_start_at = [0.0] * self.size
+        self._lock = threading.Lock()
+        self._started = False
+        self._counters = {'started': 0, 'completed': 0, 'failed': 0, 'timeouts': 0}
+        self._ewma_latency = None
+
+    def _pick(self):
+        """処理中の呼び出しが最も少ないプロセスを選ぶ（落ちたものは間隔を空けて起動し直す）"""
+        with self._lock:
+            if not self._started:
+                self._started = True
+                atexit.register(self.shutdown)
+            now = time.monotonic()
+            for index, worker in enumerate(self._workers):
+                if worker is not None and worker.alive:
+                    continue
+                if worker is not None:
+                    self._workers[index] = None
+                    self._next_start_at[index] = now + self.restart_delay
+                if now < self._next_start_at[index]:
+                    continue
+                try:
+                    self._workers[index] = NodeWorker(f"{self.name}-{index}", self.script)
+                    self._counters['started'] += 1
+                except NodeWorkerError as e:
+                    logging.error(str(e))
+                    self._next_start_at[index] = now + self.restart_delay
+            alive = [worker for worker in self._workers if worker is not None]
+        if not alive:
+            raise NodeWorkerError(f"{self.name} に使えるプロセスがありません")
+        return min(alive, key=lambda worker: worker.pending)
+
+    def call(self, method, params, timeout):
+        """method を呼び出して結果を返す（エラー・タイムアウト時はNodeWorkerErrorを送出）"""
+        worker = self._pick()
+        started_at = time.monotonic()
+        try:
+            result = worker.call(method, params, timeout)
+        except NodeWorkerTimeout:
+            self._count('timeouts')
+            raise
+        except NodeWorkerError:
+            self._count('failed')
+            raise
+        latency = time.monotonic() - started_at
+        with self._lock:
+            self._counters['completed'] += 1
+            self._ewma_latency = latency if self._ewma_latency is None else (
+                (1 - self.alpha) * self._ewma_latency + self.alpha * latency)
+        return result
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
+
+    def shutdown(self):
+        with self._lock:
+            workers, self._workers = self._workers, [None] * self.size
+        for worker in workers:
+            if worker is not None:
+                worker.stop()
+
+    def stats(self):
+        with self._lock:
+            workers = list(self._workers)
+            counters = dict(self._counters)
+            ewma_latency = self._ewma_latency
+        return {
+            'size': self.size,
+            'alive': sum(1 for worker in workers if worker is not None and worker.alive),
+            'pending': sum(worker.pending for worker in workers if worker is not None),
+            **counters,
+            'ewma_latency': round(ewma_latency, 3) if ewma_latency is not None else None
+        }
@@ -0,0 +1,118 @@
+"""
+ペイロード射影 - 上流のレスポンスから使うフィールドだけを残し、解析後の処理とキャッシュの大きさを減らす
+
+説明文のHTML・字幕・ストーリーボード・関連動画・配信可能地域などは使わないので、
+キャッシュに入れる前に捨てる。
+"""
+from cache_policy import endpoint_family
+
+# 一覧（トレンド・検索・チャンネル動画）の動画項目。欠けているフィールドは既定値で埋める
+VIDEO_SUMMARY_DEFAULTS = {
+    'videoId': '',
+    'title': '',
+    'description': '',
+    'videoThumbnails': [],
+    'lengthSeconds': 0,
+    'viewCount': 0,
+    'author': '',
+    'authorId': '',
+    'publishedText': '',
+    'published': 0,
+}
+# 検索結果のチャンネル・プレイリスト項目
+CHANNEL_SUMMARY_FIELDS = (
+    'type', 'author', 'authorId', 'authorThumbnails', 'subCount', 'videoCount', 'description'
+)
+PLAYLIST_SUMMARY_FIELDS = (
+    'type', 'title', 'playlistId', 'playlistThumbnail', 'author', 'authorId', 'videoCount'
+)
+# videos/{id}
+VIDEO_DETAIL_FIELDS = (
+    'type', 'videoId', 'title', 'description', 'videoThumbnails', 'published', 'publishedText',
+    'keywords', 'viewCount', 'likeCount', 'lengthSeconds', 'author', 'authorId',
+    'authorThumbnails', 'subCountText', 'genre', 'liveNow'
+)
+FORMAT_FIELDS = (
+    'url', 'itag', 'type', 'qualityLabel', 'resolution', 'size', 'width', 'height',
+    'bitrate', 'fps', 'container'
+)
+# channels/{id}
+CHANNEL_DETAIL_FIELDS = (
+    'author', 'authorId', 'description', 'subCount', 'totalViews', 'videoCount', 'joined',
+    'authorThumbnails', 'authorBanners', 'autoGenerated'
+)
+# comments/{id}
+COMMENT_FIELDS = (
+    'author', 'authorId', 'authorThumbnails', 'content', 'published', 'publishedText',
+    'likeCount', 'authorIsChannelOwner', 'isPinned'
+)
+
+
+def _pick(source, fields):
+    return {field: source[field] for field in fields if field in source}
+
+
+def project_video_summary(item):
+    """一覧の項目を種別毎に必要なフィールドだけにする"""
+    if not isinstance(item, dict):
+        return item
+    item_type = item.get('type', 'video')
+    if item_type == 'channel':
+        return _pick(item, CHANNEL_SUMMARY_FIELDS)
+    if item_type == 'playlist':
+        return _pick(item, PLAYLIST_SUMMARY_FIELDS)
+    summary = {'type': item_type}
+    for field, default in VIDEO_SUMMARY_DEFAULTS.items():
+        value = item.get(field)
+        summary[field] = default if value is None else value
+    return summary
+
+
+def project_video_detail(data):
+    detail = _pick(data, VIDEO_DETAIL_FIELDS)
+    detail['formatStreams'] = [_pick(fmt, FORMAT_FIELDS) for fmt in data.get('formatStreams') or []]
+    detail['adaptiveFormats'] = [_pick(fmt, FORMAT_FIELDS) for fmt in data.get('adaptiveFormats') or []]
+    return detail
+
+
+def project_comments(data):
+    comments = []
+    for comment in data.get('comments') or []:
+        projected = _pick(comment, COMMENT_FIELDS)
+        replies = comment.get('replies')
+        if isinstance(replies, dict):
+            projected['replies'] = _pick(replies, ('replyCount', 'continuation'))
+        comments.append(projected)
+    return {
+        'comments': comments,
+        'continuation': data.get('continuation'),
+        'commentCount': data.get('commentCount', 0)
+    }
+
+
+def project_payload(endpoint, data):
+    """エンドポイントに応じてレスポンスを射影（対象外の形はそのまま返す）"""
+    family = endpoint_family(endpoint)
+    parts = endpoint.strip('/').split('/')
+    if parts[:2] == ['api', 'v1']:
+        parts = parts[2:]
+
+    if isinstance(data, list):
+        if family in ('trending', 'search', 'popular', 'channels'):
+            return [project_video_summary(item) for item in data]
+        return data
+    if not isinstance(data, dict):
+        return data
+
+    if family == 'videos' and len(parts) == 2:
+        return project_video_detail(data)
+    if family == 'channels' and len(parts) == 2:
+        return _pick(data, CHANNEL_DETAIL_FIELDS)
+    if family == 'channels' and isinstance(data.get('videos'), list):
+        return {
+            'videos': [project_video_summary(item) for item in data['videos']],
+            'continuation': data.get('continuation')
+        }
+    if family == 'comments':
+        return project_comments(data)
+    return data
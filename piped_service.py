@@ -1,5 +1,10 @@
 import requests
 import logging
+import time
+import upstream_http
+from instance_scheduler import get_scheduler
+from circuit_breaker import get_breaker
+from rate_limiter import get_rate_limiter
 
 class PipedService:
     def __init__(self):
@@ -13,18 +18,45 @@ class PipedService:
             "https://api.piped.private.coffee",
             "https://pipedapi.ducks.party"
         ]
+        self.scheduler = get_scheduler('piped', self.instances)
+        self.breaker = get_breaker('piped')
+        self.limiter = get_rate_limiter('piped')
         self.timeout = 5
         
     def _make_request(self, endpoint, params=None):
         """複数のPipedインスタンスでリクエストを試行"""
-        for instance in self.instances:
+        family = endpoint.split('?')[0].split('/')[0]
+        for instance in self.scheduler.order():
+            # 送信枠のないインスタンスと遮断中の回路は飛ばす
+            if not self.limiter.try_acquire(instance):
+                continue
+            if not self.breaker.allow(instance, family):
+                self.limiter.release(instance)
+                continue
             try:
-                url = f"{instance}/{endpoint}"
-                response = requests.get(url, params=params, timeout=self.timeout)
+                url = f"{instance.rstrip('/')}/{endpoint}"
+                started_at = time.monotonic()
+                response = upstream_http.get(url, params=params, timeout=self.timeout)
                 if response.status_code == 200:
-                    return response.json()
+                    data = response.json()
+                    self.scheduler.record_success(instance, time.monotonic() - started_at)
+                    self.breaker.record_success(instance, family)
+                    self.limiter.record_success(instance)
+                    return data
+                if not upstream_http.is_instance_failure(response.status_code):
+                    # 404などの「存在しない」回答は内容側の問題なのでインスタンスの失敗として数えない
+                    self.scheduler.record_success(instance, time.monotonic() - started_at)
+                    self.breaker.record_success(instance, family)
+                    self.limiter.record_success(instance)
+                    continue
+                self.scheduler.record_failure(instance, upstream_http.UpstreamHTTPError(response.status_code, url))
+                self.breaker.record_failure(instance, family)
+                if response.status_code == 429:
+                    self.limiter.record_throttled(instance, upstream_http.retry_after(response))
             except requests.RequestException as e:
                 logging.warning(f"Piped instance {instance} failed: {e}")
+                self.scheduler.record_failure(instance, e)
+                self.breaker.record_failure(instance, family)
                 continue
         return None
     
@@ -0,0 +1,258 @@
+"""
+プロセスプール - CPU負荷の高い処理を別プロセスで実行し、リクエスト処理スレッドのGILを塞がない
+
+待ち行列は上限付きで、溢れた分は待たせずにPoolQueueFullで断る。
+1件毎に制限時間があり、超えたプロセスは強制終了して作り直す（他の処理には影響しない）。
+プロセスが落ちた場合も同様に作り直し、一定件数を処理したプロセスはメモリ解放のため入れ替える。
+"""
+import atexit
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+# gunicornのスレッド付きワーカーからforkするとロックを抱えたまま複製されるためspawnを使う
+_context = multiprocessing.get_context('spawn')
+
+_LATENCY_SAMPLES = 200
+
+
+class PoolQueueFull(Exception):
+    """待ち行列が満杯"""
+
+
+class JobTimeout(Exception):
+    """制限時間内に処理が終わらず、プロセスを止めた"""
+
+
+class WorkerCrashed(Exception):
+    """処理中にプロセスが終了した"""
+
+
+class RemoteJobError(Exception):
+    """ワーカープロセス内で処理が例外を送出した（メッセージのみ引き継ぐ）"""
+
+
+def _worker_main(conn, target):
+    while True:
+        try:
+            args = conn.recv()
+        except (EOFError, OSError):
+            return
+        if args is None:
+            return
+        try:
+            conn.send((True, target(*args)))
+        except Exception as e:
+            # 例外オブジェクトはpickleできるとは限らないため文字列で返す
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+class _Job:
+    __slots__ = ('args', 'timeout', 'future', 'enqueued_at')
+
+    def __init__(self, args, timeout):
+        self.args = args
+        self.timeout = timeout
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class _WorkerSlot:
+    """ディスパッチ用スレッド1本と子プロセス1つの組"""
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.jobs = 0
+
+    def _start_process(self):
+        parent_conn, child_conn = _context.Pipe()
+        self.process = _context.Process(
+            target=_worker_main, args=(child_conn, self.pool.target),
+            name=f"{self.pool.name}-{self.index}", daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.jobs = 0
+
+    def stop_process(self, graceful=True):
+        process, conn = self.process, self.conn
+        self.process = self.conn = None
+        if process is None:
+            return
+        if graceful and process.is_alive():
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(1.0)
+        if process.is_alive():
+            process.kill()
+            process.join(1.0)
+        conn.close()
+
+    def run(self):
+        pool = self.pool
+        while True:
+            job = pool._queue.get()
+            if job is None:
+                self.stop_process()
+                return
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            pool._record_wait(time.monotonic() - job.enqueued_at)
+            pool._set_busy(+1)
+            try:
+                self._run_job(job)
+            finally:
+                pool._set_busy(-1)
+
+    def _run_job(self, job):
+        pool = self.pool
+        if self.process is None or not self.process.is_alive():
+            self.stop_process(graceful=False)
+            self._start_process()
+        started_at = time.monotonic()
+        try:
+            self.conn.send(job.args)
+            if not self.conn.poll(job.timeout):
+                self.stop_process(graceful=False)
+                pool._count('timeouts')
+                job.future.set_exception(JobTimeout(f"{job.timeout}秒以内に終わりませんでした: {job.args}"))
+                return
+            ok, value = self.conn.recv()
+        except (EOFError, OSError) as e:
+            self.process.join(1.0)
+            exitcode = self.process.exitcode
+            self.stop_process(graceful=False)
+            pool._count('crashes')
+            if not pool._closed:
+                logging.warning(f"{pool.name} のプロセスが終了しました（終了コード {exitcode}）: {e!r}")
+            job.future.set_exception(WorkerCrashed(f"処理中にプロセスが終了しました（終了コード {exitcode}）"))
+            return
+
+        pool._record_run(time.monotonic() - started_at)
+        self.jobs += 1
+        if self.jobs >= pool.max_jobs:
+            self.stop_process()
+            pool._count('recycled')
+        if ok:
+            pool._count('completed')
+            job.future.set_result(value)
+        else:
+            pool._count('failed')
+            job.future.set_exception(RemoteJobError(value))
+
+
+class ProcessPool:
+    def __init__(self, name, target, workers, queue_size, job_timeout, max_jobs):
+        # target はワーカープロセスから読み込めるモジュール直下の関数であること
+        self.name = name
+        self.target = target
+        self.workers = max(1, workers)
+        self.job_timeout = job_timeout
+        self.max_jobs = max(1, max_jobs)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._slots = []
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+        self._busy = 0
+        self._counters = {
+            'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0,
+            'timeouts': 0, 'crashes': 0, 'recycled': 0
+        }
+        self._wait_times = deque(maxlen=_LATENCY_SAMPLES)
+        self._run_times = deque(maxlen=_LATENCY_SAMPLES)
+
+    def _ensure_started(self):
+        # プロセスは最初の投入時に起動する（使わないワーカーでは何も起動しない）
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for index in range(self.workers):
+                slot = _WorkerSlot(self, index)
+                self._slots.append(slot)
+                threading.Thread(target=slot.run, name=f"{self.name}-dispatch-{index}", daemon=True).start()
+        atexit.register(self.shutdown)
+
+    def submit(self, *args, timeout=None):
+        """target(*args) を投入してFutureを返す（待ち行列が満杯ならPoolQueueFullを送出）"""
+        if self._closed:
+            raise RuntimeError(f"{self.name} は停止しています")
+        self._ensure_started()
+        job = _Job(args, timeout or self.job_timeout)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._count('rejected')
+            raise PoolQueueFull(f"{self.name} の待ち行列が満杯です（{self._queue.maxsize}件）")
+        self._count('submitted')
+        return job.future
+
+    def shutdown(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            slots = list(self._slots)
+        # 待ち行列に残った処理は取り消してから停止を伝える
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job.future.cancel()
+        for _ in slots:
+            self._queue.put(None)
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
+
+    def _set_busy(self, delta):
+        with self._lock:
+            self._busy += delta
+
+    def _record_wait(self, seconds):
+        with self._lock:
+            self._wait_times.append(seconds)
+
+    def _record_run(self, seconds):
+        with self._lock:
+            self._run_times.append(seconds)
+
+    @staticmethod
+    def _summary(samples):
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return {
+            'avg': round(sum(ordered) / len(ordered), 3),
+            'p50': round(ordered[len(ordered) // 2], 3),
+            'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+            'max': round(ordered[-1], 3)
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'started': self._started,
+                'alive': sum(1 for slot in self._slots if slot.process is not None and slot.process.is_alive()),
+                'busy': self._busy,
+                'queue_depth': self._queue.qsize(),
+                'queue_size': self._queue.maxsize,
+                **self._counters,
+                'queue_wait': self._summary(self._wait_times),
+                'run_time': self._summary(self._run_times)
+            }
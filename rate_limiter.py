@@ -0,0 +1,121 @@
+"""
+レートリミッター - インスタンス毎のトークンバケットで上流への送信ペースを抑える
+
+429を受けるとRetry-Afterの間は送信を止め、補充速度を半分にする。成功が続くと少しずつ戻す（AIMD）。
+"""
+import threading
+import time
+from config import (
+    RATE_LIMIT_RATE, RATE_LIMIT_BURST, RATE_LIMIT_MIN_RATE, RATE_LIMIT_RECOVERY,
+    RATE_LIMIT_DEFAULT_RETRY_AFTER, RATE_LIMIT_MAX_RETRY_AFTER
+)
+
+
+class _Bucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.tokens = float(burst)
+        self.updated_at = now
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self.upstream_429 = 0
+
+    def refill(self, now, burst):
+        self.tokens = min(float(burst), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class RateLimiter:
+    def __init__(self, name, rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST, min_rate=RATE_LIMIT_MIN_RATE,
+                 recovery=RATE_LIMIT_RECOVERY, default_retry_after=RATE_LIMIT_DEFAULT_RETRY_AFTER,
+                 max_retry_after=RATE_LIMIT_MAX_RETRY_AFTER):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.default_retry_after = default_retry_after
+        self.max_retry_after = max_retry_after
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, instance, now):
+        bucket = self._buckets.get(instance)
+        if bucket is None:
+            bucket = self._buckets[instance] = _Bucket(self.rate, self.burst, now)
+        return bucket
+
+    def try_acquire(self, instance):
+        """トークンを1つ取る（取れなければFalseで、呼び出し側は次のインスタンスへ回す）"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(instance, now)
+            bucket.refill(now, self.burst)
+            if now < bucket.blocked_until or bucket.tokens < 1:
+                bucket.throttled += 1
+                return False
+            bucket.tokens -= 1
+            return True
+
+    def release(self, instance):
+        """取ったトークンを使わずに返す（送信前に他の理由で取りやめた場合）"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(instance, now)
+            bucket.refill(now, self.burst)
+            bucket.tokens = min(float(self.burst), bucket.tokens + 1)
+
+    def record_success(self, instance):
+        """成功したら補充速度を少しずつ既定値へ戻す"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(instance, now)
+            if bucket.rate < self.rate:
+                bucket.refill(now, self.burst)
+                bucket.rate = min(self.rate, bucket.rate + self.recovery)
+
+    def record_throttled(self, instance, retry_after=None):
+        """429を受けたらRetry-Afterの間は送信を止め、補充速度を半分にする"""
+        now = time.monotonic()
+        if not retry_after or retry_after <= 0:
+            retry_after = self.default_retry_after
+        with self._lock:
+            bucket = self._bucket(instance, now)
+            bucket.refill(now, self.burst)
+            bucket.upstream_429 += 1
+            bucket.rate = max(self.min_rate, bucket.rate / 2)
+            bucket.tokens = 0.0
+            bucket.blocked_until = max(bucket.blocked_until, now + min(retry_after, self.max_retry_after))
+
+    def snapshot(self):
+        """インスタンス毎の残りトークンと抑制回数（確認API用）"""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for instance, bucket in self._buckets.items():
+                bucket.refill(now, self.burst)
+                result[instance] = {
+                    'tokens': round(bucket.tokens, 2),
+                    'rate': round(bucket.rate, 3),
+                    'blocked_for': round(max(0.0, bucket.blocked_until - now), 1),
+                    'throttled': bucket.throttled,
+                    'upstream_429': bucket.upstream_429
+                }
+            return result
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name):
+    """名前付きの共有レートリミッターを取得"""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(name)
+        return _limiters[name]
+
+
+def all_rate_limiters():
+    with _limiters_lock:
+        return dict(_limiters)
@@ -0,0 +1,241 @@
+"""
+レスポンスキャッシュ - エントリ数とバイト数の上限付きLRU＋TTLキャッシュ
+"""
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES, SHARED_CACHE_ENABLED
+)
+from shared_cache import SharedCacheStore
+import json_codec
+
+
+def estimate_size(value):
+    """キャッシュ値のおおよそのバイト数"""
+    try:
+        return len(json_codec.dumps(value).encode('utf-8'))
+    except (TypeError, ValueError):
+        return 1024
+
+
+class ResponseCache:
+    """プロセス内のL1キャッシュ。l2を渡すとワーカー間共有ストアを下位層として使う
+
+    期限切れの値はstale_ttlの間だけ保持され、get_stale()で取り出せる（stale-while-revalidate用）。
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 default_ttl=RESPONSE_CACHE_TTL, l2=None):
+        self.l2 = l2
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (value, stored_at, expires_at, retain_until, size)
+        self._bytes = 0
+        self._last_purge = time.time()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self.hits = 0
+        self.l2_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[4]
+        return entry
+
+    def _lookup(self, key, now):
+        """保持期間内のエントリを返す（保持期間を過ぎたものは削除）"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[3] <= now:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        return entry
+
+    def get(self, key):
+        """有効な値を返す（L1になければL2を確認）"""
+        now = time.time()
+        with self._lock:
+            entry = self._lookup(key, now)
+            if entry is not None and entry[2] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        # 他のワーカーが保存した値もヒットとして数え、L2にもなければミスにする
+        entry = self._get_from_l2(key, now, max_stale=0)
+        with self._lock:
+            if entry is not None:
+                self.l2_hits += 1
+            else:
+                self.misses += 1
+        return entry[0] if entry else None
+
+    def get_stale(self, key, max_stale):
+        """期限切れからmax_stale秒以内の値を (value, 期限切れからの秒数) で返す"""
+        now = time.time()
+        with self._lock:
+            entry = self._lookup(key, now)
+        if entry is None:
+            entry = self._get_from_l2(key, now, max_stale)
+        if entry is None or now - entry[2] > max_stale:
+            return None
+        with self._lock:
+            self.stale_hits += 1
+        return entry[0], max(0.0, now - entry[2])
+
+    def _get_from_l2(self, key, now, max_stale):
+        """L2の値を残り保持期間のままL1に昇格"""
+        if self.l2 is None:
+            return None
+        entry = self.l2.get(key, max_stale=max_stale)
+        if entry is None:
+            return None
+        value, stored_at, expires_at, retain_until, size = entry
+        self._store(key, value, stored_at, expires_at, retain_until, size)
+        return value, stored_at, expires_at
+
+    def set(self, key, value, ttl=None, size=None, stale_ttl=0):
+        """値を保存（stale_ttlは期限切れ後も古い値として保持する秒数）"""
+        now = time.time()
+        ttl = self.default_ttl if ttl is None else ttl
+        size = estimate_size(value) if size is None else size
+        expires_at = now + ttl
+        retain_until = expires_at + stale_ttl
+        self._store(key, value, now, expires_at, retain_until, size)
+        if self.l2 is not None:
+            self.l2.set(key, value, now, expires_at, retain_until)
+
+    def _store(self, key, value, stored_at, expires_at, retain_until, size):
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, stored_at, expires_at, retain_until, size)
+            self._bytes += size
+            # 上限超過時か1分毎に保持期間切れをまとめて解放
+            if (len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+                    or now - self._last_purge > 60):
+                self._purge_expired(now)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+        if self.l2 is not None:
+            self.l2.delete(key)
+
+    def begin_fill(self, key, lease):
+        """上流から取得する権利を取る（他ワーカーが取得中ならFalse）"""
+        if self.l2 is None:
+            return True
+        return self.l2.begin_fill(key, lease)
+
+    def end_fill(self, key):
+        if self.l2 is not None:
+            self.l2.end_fill(key)
+
+    def wait_for_fill(self, key, timeout):
+        """他ワーカーの取得結果がL2に入るのを待つ（取得が中断されたらNone）"""
+        if self.l2 is None:
+            return None
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            entry = self._get_from_l2(key, time.time(), max_stale=0)
+            if entry is not None:
+                return entry[0]
+            if not self.l2.fill_in_progress(key):
+                # 確認の間に保存されて印が外れた場合を取りこぼさないよう、もう一度読む
+                entry = self._get_from_l2(key, time.time(), max_stale=0)
+                return entry[0] if entry is not None else None
+            time.sleep(0.05)
+        return None
+
+    def begin_refresh(self, key):
+        """バックグラウンド更新をキー毎に1つに制限"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def export_entries(self, include, limit):
+        """include(key)に合う保持期間内のエントリを新しく使われた順に最大limit件返す"""
+        now = time.time()
+        with self._lock:
+            exported = []
+            for key in reversed(self._entries):
+                if len(exported) >= limit:
+                    break
+                value, stored_at, expires_at, retain_until, size = self._entries[key]
+                if retain_until > now and include(key):
+                    exported.append((key, value, stored_at, expires_at, retain_until))
+            return exported
+
+    def import_entries(self, entries):
+        """export_entries()の値を元の期限のまま復元（保持期間切れとL1にあるキーは飛ばす）"""
+        now = time.time()
+        restored = 0
+        # 古い順に入れてLRUの順序を保つ
+        for key, value, stored_at, expires_at, retain_until in reversed(entries):
+            if retain_until <= now:
+                continue
+            with self._lock:
+                if key in self._entries:
+                    continue
+            self._store(key, value, stored_at, expires_at, retain_until, estimate_size(value))
+            restored += 1
+        return restored
+
+    def _purge_expired(self, now):
+        expired = [key for key, entry in self._entries.items() if entry[3] <= now]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        self._last_purge = now
+
+    def purge_expired(self):
+        """保持期間切れのエントリを削除してメモリを解放"""
+        with self._lock:
+            self._purge_expired(time.time())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.l2_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'l2_hits': self.l2_hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.l2_hits) / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'refreshing': len(self._refreshing),
+                'l2': self.l2.stats() if self.l2 is not None else None
+            }
+
+
+# ワーカー内の全InvidiousServiceで共有するキャッシュ（L2はワーカー間で共有）
+shared_response_cache = ResponseCache(l2=SharedCacheStore() if SHARED_CACHE_ENABLED else None)
@@ -1,11 +1,27 @@
-from flask import render_template, request, jsonify, redirect, url_for
+from flask import render_template, request, jsonify, redirect, url_for, session
 from app import app
 from invidious_service import InvidiousService
 from piped_service import PipedService
 from ytdl_service import YtdlService
 from additional_services import AdditionalStreamServices
-from turbo_video_service import TurboVideoService
+from turbo_video_service import TurboVideoService, node_workers
 from user_preferences import user_prefs
+from instance_scheduler import all_schedulers
+from instance_prober import start_prober, get_prober
+from circuit_breaker import all_breakers
+from rate_limiter import all_rate_limiters
+from response_cache import shared_response_cache
+from shared_cache import SharedCacheStore
+from single_flight import all_single_flight_stats
+from negative_cache import negative_cache
+from stream_cache import stream_cache
+from stream_resolver import StreamResolver
+from deadline import Deadline
+from fan_out import gather
+from warm_snapshot import start_warm_snapshot, get_warm_snapshot
+from shorts_feed import ShortsFeedStore, new_feed_id
+from config import (PROBE_ENABLED, WARM_SNAPSHOT_ENABLED, WATCH_DEADLINE, STREAM_API_DEADLINE, STREAM_BATCH_MAX_IDS,
+                    SHORTS_FEED_PAGE_SIZE, SHARED_CACHE_ENABLED)
 import logging
 
 invidious = InvidiousService()
@@ -14,6 +30,27 @@ ytdl = YtdlService()
 additional_services = AdditionalStreamServices()
 turbo_service = TurboVideoService()
 
+# ストリーム取得元（既定の優先順と想定レイテンシ）。/watchと/api/streamで共有
+stream_resolver = StreamResolver([
+    ('invidious', lambda video_id, deadline: invidious.get_stream_urls(video_id, deadline=deadline), 1.0),
+    ('ytdl', lambda video_id, deadline: ytdl.get_stream_urls(video_id, deadline=deadline), 4.0),
+    ('wakame', lambda video_id, deadline: additional_services.get_wakame_high_quality_stream(video_id, deadline=deadline), 5.0)
+])
+
+# セッション毎のショート動画フィード（一度組み立てたらカーソルで返す。ワーカー間で共有する）
+shorts_feeds = ShortsFeedStore(invidious, user_prefs, shared=SharedCacheStore() if SHARED_CACHE_ENABLED else None)
+
+# 前回のスコアとキャッシュを読み込んで温まった状態で起動（以降は定期保存）
+if WARM_SNAPSHOT_ENABLED:
+    start_warm_snapshot()
+
+# 上流インスタンスの死活監視（前回の結果で起動し、初回の監視は裏で実行してから定期実行）
+if PROBE_ENABLED:
+    start_prober({
+        'invidious': (invidious.scheduler, 'api/v1/stats'),
+        'piped': (piped.scheduler, 'healthcheck')
+    })
+
 @app.route('/')
 def index():
     try:
@@ -118,45 +155,41 @@ def watch():
     if not video_id:
         return redirect(url_for('index'))
     try:
-        # 動画情報を1回だけ取得
-        video_info = invidious.get_video_info(video_id)
+        # 各取得はリクエスト全体の残り時間の中で行う
+        deadline = Deadline(WATCH_DEADLINE)
+        
+        def load_video_and_streams():
+            # 動画の種類毎の成績で取得元の順番を決めるため、動画情報を先に取得する
+            # （Invidiousのストリームは同じ上流レスポンスを使うので追加の取得はない）
+            info = invidious.get_video_info(video_id, deadline=deadline)
+            if not info:
+                return None, None
+            return info, stream_resolver.resolve(video_id, video_info=info, deadline=deadline)[1]
+        
+        # 動画情報＋ストリームとコメントは独立しているので並列に取得
+        results, _ = gather({
+            'video': load_video_and_streams,
+            'comments': lambda: invidious.get_video_comments(video_id, deadline=deadline)
+        }, deadline=deadline)
+        
+        video_info, stream_data = results.get('video') or (None, None)
         if not video_info:
+            if deadline.expired():
+                return render_template('watch.html', error="動画情報の取得に時間がかかっています。しばらくしてから再度お試しください。")
             return render_template('watch.html', error="動画が見つかりません。")
         
-        # ストリーム取得を高速化 - 最も確実なソースから順番に
-        stream_data = None
-        
-        # 1. Invidiousから直接取得（最速）
-        try:
-            stream_data = invidious.get_stream_urls(video_id)
-        except Exception as e:
-            logging.warning(f"Invidious stream error: {e}")
-        
-        # 2. yt-dlpを試行
-        if not stream_data:
-            try:
-                stream_data = ytdl.get_stream_urls(video_id)
-            except Exception as e:
-                logging.warning(f"ytdl stream error: {e}")
-        
-        # 3. 追加サービスを試行
-        if not stream_data:
-            try:
-                stream_data = additional_services.get_wakame_high_quality_stream(video_id)
-            except Exception as e:
-                logging.warning(f"Additional services error: {e}")
-        
         if not stream_data:
+            if deadline.expired():
+                logging.warning(f"持ち時間切れのためストリーム取得を打ち切りました: {video_id}")
+                return render_template('watch.html', 
+                                     video_info=video_info,
+                                     error="ストリームの取得に時間がかかっています。しばらくしてから再度お試しください。")
             return render_template('watch.html', 
                                  video_info=video_info,
                                  error="動画のストリームURLを取得できませんでした。")
         
-        # コメントを非同期で取得（最小限）
-        comments_data = {'comments': [], 'continuation': None}
-        try:
-            comments_data = invidious.get_video_comments(video_id)
-        except Exception as e:
-            logging.warning(f"Comments error: {e}")
+        # コメント（取得できなかった場合は空）
+        comments_data = results.get('comments') or {'comments': [], 'continuation': None}
         
         # 視聴履歴を記録
         user_prefs.record_watch(video_info)
@@ -179,8 +212,8 @@ def channel(channel_id):
         channel_name = request.args.get('name', '')
         sort = request.args.get('sort', 'newest')
         
-        # 直接チャンネル情報を取得（高速化）
-        channel_info = invidious.get_channel_info(channel_id)
+        # チャンネル情報と動画一覧を取得（1ページ目はチャンネル単位でキャッシュ済み）
+        channel_info, videos = invidious.get_channel_page(channel_id, page=page, sort=sort)
         if not channel_info and channel_name:
             # フォールバック: チャンネル名で基本情報作成
             channel_info = {
@@ -196,9 +229,6 @@ def channel(channel_id):
                 'autoGenerated': False
             }
         
-        # チャンネル動画を直接取得（高速化）
-        videos = invidious.get_channel_videos(channel_id, page=page, sort=sort)
-        
         # フォールバック: 検索による動画取得
         if not videos and channel_name:
             search_results = invidious.search_videos(f"channel:{channel_name}", page=page)
@@ -262,10 +292,10 @@ def channel(channel_id):
 def shorts():
     """ショート動画メインページ（最初の動画にリダイレクト）"""
     try:
-        # 最初のショート動画を取得
-        response = api_shorts_list()
-        if response.get('success') and response.get('videos'):
-            first_video_id = response['videos'][0]['videoId']
+        # セッションのフィードから最初のショート動画を取得
+        videos, _, _ = shorts_feeds.page(_shorts_feed_id(), 0, 1)
+        if videos:
+            first_video_id = videos[0]['videoId']
             return redirect(url_for('shorts_video', video_id=first_video_id))
         else:
             return render_template('shorts.html', error="ショート動画が見つかりません")
@@ -300,109 +330,37 @@ def shorts_video(video_id):
         logging.error(f"ショート動画取得エラー: {e}")
         return redirect(url_for('shorts'))
 
+def _shorts_feed_id(refresh=False):
+    """セッションのショート動画フィードID（refreshなら作り直す）"""
+    feed_id = session.get('shorts_feed_id')
+    if refresh and feed_id:
+        shorts_feeds.drop(feed_id)
+    if refresh or not feed_id:
+        feed_id = session['shorts_feed_id'] = new_feed_id()
+    return feed_id
+
 @app.route('/api/shorts-list')
 def api_shorts_list():
-    """個人化された日本のショート動画リストAPI - 大幅改善版"""
+    """個人化された日本のショート動画リストAPI（セッション毎のフィードをcursorからlimit件）
+
+    fromに動画IDを渡すと、フィード内のその動画の位置から返す（含まれなければ先頭から）。
+    """
     try:
-        shorts_videos = []
-        
-        # ユーザーの好みに基づいた推奨キーワードを取得
-        recommended_keywords = user_prefs.get_recommendation_keywords()
-        logging.info(f"推奨キーワード: {recommended_keywords[:5]}")
-        
-        # より多くのソースから動画を収集
-        search_queries = []
-        
-        # 好みのチャンネルからの動画を優先検索
-        preferred_channels = user_prefs.get_preferred_channels()
-        for channel_name, count in preferred_channels[:5]:  # 上位5チャンネル
-            search_queries.append(f"channel:{channel_name}")
-        
-        # 推奨キーワード追加
-        search_queries.extend(recommended_keywords[:15])
-        
-        # 日本の人気ジャンル追加
-        popular_genres = [
-            "面白い", "おもしろ", "爆笑", "ネタ", "コメディ",
-            "料理", "レシピ", "簡単", "DIY", "手作り",
-            "ダンス", "踊り", "TikTok", "バズった",
-            "猫", "犬", "ペット", "動物", "可愛い",
-            "ゲーム", "実況", "攻略", "プレイ",
-            "メイク", "ファッション", "コーデ", "美容",
-            "スポーツ", "サッカー", "野球", "バスケ",
-            "歌ってみた", "弾いてみた", "演奏", "カバー",
-            "vlog", "日常", "ルーティン", "モーニング"
-        ]
-        search_queries.extend(popular_genres)
-        
-        # 検索実行
-        for query in search_queries[:25]:  # 最大25クエリ
-            try:
-                search_results = invidious.search_videos(query, page=1)
-                if search_results and isinstance(search_results, list):
-                    videos_list = search_results[:6]  # 各クエリから6件
-                elif search_results and search_results.get('success'):
-                    videos_list = search_results.get('videos', [])[:6]
-                else:
-                    videos_list = []
-                
-                for video in videos_list:
-                        duration = video.get('lengthSeconds', 0)
-                        if 10 <= duration <= 300:  # 10秒～5分に拡大
-                            video_id = video.get('videoId')
-                            if video_id not in [v.get('videoId') for v in shorts_videos]:
-                                if user_prefs.should_recommend_video(video):
-                                    shorts_videos.append(video)
-                                    if len(shorts_videos) >= 80:  # 80件まで収集
-                                        break
-                
-                if len(shorts_videos) >= 80:
-                    break
-                    
-            except Exception as e:
-                logging.warning(f"検索エラー ({query}): {e}")
-                continue
-        
-        # トレンド動画からも大量追加
-        trending_types = ['', 'Music', 'Gaming']
-        for trend_type in trending_types:
-            if len(shorts_videos) >= 80:
-                break
-                
-            try:
-                if trend_type:
-                    trending_videos = invidious.get_trending_videos(region='JP')
-                else:
-                    trending_videos = invidious.get_trending_videos(region='JP')
-                
-                if trending_videos:
-                    videos_list = trending_videos if isinstance(trending_videos, list) else trending_videos.get('videos', [])
-                    for video in videos_list[:15]:  # トレンドから15件
-                        duration = video.get('lengthSeconds', 0)
-                        if 10 <= duration <= 300:  # 範囲拡大
-                            video_id = video.get('videoId')
-                            if video_id not in [v.get('videoId') for v in shorts_videos]:
-                                if user_prefs.should_recommend_video(video):
-                                    shorts_videos.append(video)
-                                    if len(shorts_videos) >= 80:
-                                        break
-            except Exception as e:
-                logging.warning(f"トレンド動画取得エラー: {e}")
-        
-        # 多様性を保つため、ランダムに並び替え
-        import random
-        random.shuffle(shorts_videos)
-        
-        # 短い動画を優先しつつ、多様性も保つ
-        shorts_videos.sort(key=lambda x: (x.get('lengthSeconds', 0), random.random()))
-        
-        logging.info(f"ショート動画 {len(shorts_videos)} 件を取得")
+        feed_id = _shorts_feed_id(refresh=request.args.get('refresh') == '1')
+        cursor = request.args.get('cursor', 0, type=int)
+        from_video_id = request.args.get('from')
+        if from_video_id:
+            cursor = max(shorts_feeds.position(feed_id, from_video_id), 0)
+        limit = min(max(request.args.get('limit', SHORTS_FEED_PAGE_SIZE, type=int), 1), 50)
+        videos, next_cursor, has_more = shorts_feeds.page(feed_id, cursor, limit)
         
         return jsonify({
             'success': True,
-            'videos': shorts_videos,  # 全件返す
-            'has_more': True,  # 常に追加読み込み可能
-            'total': len(shorts_videos)
+            'videos': videos,
+            'cursor': cursor,
+            'next_cursor': next_cursor if has_more else None,
+            'has_more': has_more,
+            'total': shorts_feeds.size(feed_id)
         })
     except Exception as e:
         logging.error(f"ショート動画リスト取得エラー: {e}")
@@ -416,53 +374,15 @@ def api_shorts_list():
 def api_shorts_next(current_video_id):
     """次のショート動画を取得"""
     try:
-        # 現在の動画リストを取得
-        response = api_shorts_list()
-        if hasattr(response, 'get_json'):
-            response_data = response.get_json()
-        else:
-            response_data = response
-            
-        if not response_data.get('success'):
-            return jsonify({'success': False, 'error': 'No videos available'})
-        
-        videos = response_data['videos']
-        current_index = -1
-        
-        # 現在の動画のインデックスを探す
-        for i, video in enumerate(videos):
-            if video.get('videoId') == current_video_id:
-                current_index = i
-                break
-        
-        # 次の動画を取得
-        next_index = current_index + 1
-        if next_index < len(videos):
-            return jsonify({
-                'success': True,
-                'video': videos[next_index],
-                'has_next': next_index + 1 < len(videos)
-            })
-        else:
-            # 新しい動画を生成して追加
-            import random
-            additional_keywords = ["エンタメ", "動物", "グルメ", "スポーツ", "技術"]
-            for keyword in additional_keywords:
-                try:
-                    search_results = invidious.search_videos(keyword, page=random.randint(1, 3))
-                    for video in search_results[:2]:
-                        duration = video.get('lengthSeconds', 0)
-                        if 15 <= duration <= 180:
-                            if user_prefs.should_recommend_video(video):
-                                return jsonify({
-                                    'success': True,
-                                    'video': video,
-                                    'has_next': True
-                                })
-                except:
-                    continue
-            
+        position, video, has_next = shorts_feeds.neighbour(_shorts_feed_id(), current_video_id, 1)
+        if video is None:
             return jsonify({'success': False, 'error': 'No more videos'})
+        return jsonify({
+            'success': True,
+            'video': video,
+            'cursor': position,
+            'has_next': has_next
+        })
             
     except Exception as e:
         logging.error(f"次の動画取得エラー: {e}")
@@ -472,27 +392,15 @@ def api_shorts_next(current_video_id):
 def api_shorts_prev(current_video_id):
     """前のショート動画を取得"""
     try:
-        response = api_shorts_list()
-        if not response.get('success'):
-            return jsonify({'success': False, 'error': 'No videos available'})
-        
-        videos = response['videos']
-        current_index = -1
-        
-        for i, video in enumerate(videos):
-            if video.get('videoId') == current_video_id:
-                current_index = i
-                break
-        
-        prev_index = current_index - 1
-        if prev_index >= 0:
-            return jsonify({
-                'success': True,
-                'video': videos[prev_index],
-                'has_prev': prev_index > 0
-            })
-        else:
+        position, video, has_prev = shorts_feeds.neighbour(_shorts_feed_id(), current_video_id, -1)
+        if video is None:
             return jsonify({'success': False, 'error': 'No previous videos'})
+        return jsonify({
+            'success': True,
+            'video': video,
+            'cursor': position,
+            'has_prev': has_prev
+        })
             
     except Exception as e:
         logging.error(f"前の動画取得エラー: {e}")
@@ -516,65 +424,73 @@ def api_comments(video_id):
             'comments': []
         })
 
+def _select_api_stream(stream_data):
+    """APIで返すストリームを選ぶ（720pを優先し、なければ先頭 = 音声付き優先の並び）"""
+    formats = stream_data.get('formats') or []
+    for fmt in formats:
+        if fmt.get('url') and fmt.get('quality') and '720' in str(fmt.get('quality')):
+            return fmt['url'], fmt
+    if formats and formats[0].get('url'):
+        return formats[0]['url'], formats[0]
+    return stream_data.get('best_url') or stream_data.get('video_url'), None
+
+# ネガティブキャッシュの理由毎のメッセージ（再生不可は非公開・地域制限・著作権制限などの制限による）
+_UNAVAILABLE_MESSAGES = {
+    'not_found': "この動画は削除されたか、存在しません。",
+    'unplayable': "この動画は非公開・地域制限・著作権制限などにより再生できません。"
+}
+
+def _unavailable_payload(reason):
+    """再生できないと記録済みの動画への応答（copyright_restrictedは制限による場合のみ）"""
+    return {
+        "success": False,
+        "error": _UNAVAILABLE_MESSAGES.get(reason, "この動画は再生できません。"),
+        "reason": reason,
+        "copyright_restricted": reason == 'unplayable'
+    }
+
+def _stream_payload(stream_data, source):
+    """ストリームAPIで返す内容（使えるURLがなければNone）"""
+    stream_url, fmt = _select_api_stream(stream_data)
+    if not stream_url:
+        return None
+    return {
+        "success": True,
+        "stream_url": stream_url,
+        "audio_url": fmt.get('audio_url') if fmt else stream_data.get('audio_url'),
+        "has_audio": fmt.get('has_audio', True) if fmt else stream_data.get('has_audio', True),
+        "title": stream_data.get('title', ''),
+        "duration": stream_data.get('duration', 0),
+        "quality": fmt.get('quality', 'auto') if fmt else "auto",
+        "source": source
+    }
+
 @app.route('/api/stream/<video_id>')
 def api_stream(video_id):
     """APIエンドポイント：動画ストリーム取得 - 音声付き優先"""
     try:
-        # Invidiousサービスを最優先（安定性重視）
-        invidious_result = invidious.get_stream_urls(video_id)
-        if invidious_result:
-            # 720p以上の品質を探す
-            best_url = None
-            audio_url = None
-            has_audio = True
-            
-            # 適切なフォーマットを選択
-            if isinstance(invidious_result, dict):
-                if invidious_result.get('formats'):
-                    # 720p音声付きを優先
-                    for fmt in invidious_result.get('formats', []):
-                        if fmt.get('quality') and '720' in str(fmt.get('quality')):
-                            best_url = fmt.get('url')
-                            break
-                    
-                    # フォールバック：最高品質
-                    if not best_url and invidious_result.get('formats'):
-                        best_url = invidious_result['formats'][0].get('url')
-                
-                elif invidious_result.get('video_url'):
-                    best_url = invidious_result.get('video_url')
-                    audio_url = invidious_result.get('audio_url')
-                    has_audio = invidious_result.get('has_audio', True)
-            
-            if best_url:
-                response_data = {
-                    "success": True,
-                    "stream_url": best_url,
-                    "audio_url": audio_url,
-                    "has_audio": has_audio,
-                    "title": invidious_result.get('title', ''),
-                    "duration": invidious_result.get('duration', 0),
-                    "quality": "720p",
-                    "source": "invidious"
-                }
-                return jsonify(response_data)
-        
-        # フォールバック：yt-dlp（簡単なフォーマット指定）
-        try:
-            ytdl_result = ytdl.get_stream_urls(video_id)
-            if ytdl_result and ytdl_result.get('success'):
-                response_data = {
-                    "success": True,
-                    "stream_url": ytdl_result.get('best_url') or ytdl_result.get('video_url'),
-                    "has_audio": True,
-                    "title": ytdl_result.get('title', ''),
-                    "duration": ytdl_result.get('duration', 0),
-                    "quality": "auto",
-                    "source": "ytdl"
-                }
-                return jsonify(response_data)
-        except Exception as e:
-            logging.warning(f"yt-dlp失敗: {e}")
+        # 再生できないと分かっている動画はすぐに返す
+        unavailable_reason = negative_cache.get('video', video_id)
+        if unavailable_reason:
+            return jsonify(_unavailable_payload(unavailable_reason)), 404
+        
+        # 各取得はリクエスト全体の残り時間の中で行う
+        deadline = Deadline(STREAM_API_DEADLINE)
+        
+        # 取得元を時間差で競争させ、最初に使えたものを返す（/watchと同じ解決器）
+        source, stream_data = stream_resolver.resolve(
+            video_id, video_info=invidious.peek_video_info(video_id), deadline=deadline)
+        
+        payload = _stream_payload(stream_data, source) if stream_data else None
+        if payload:
+            return jsonify(payload)
+        
+        if deadline.expired():
+            return jsonify({
+                "success": False,
+                "error": "ストリームの取得に時間がかかっています。しばらくしてから再度お試しください。",
+                "timeout": True
+            }), 504
         
         return jsonify({
             "success": False,
@@ -586,7 +502,168 @@ def api_stream(video_id):
         logging.error(f"ストリームAPI エラー: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+# 一括取得でキャッシュを探す取得元（解決器の既定の優先順）
+_CACHED_STREAM_SOURCES = ('invidious', 'ytdl', 'wakame', 'turbo')
+
+def _cached_stream(video_id):
+    """URLが失効していないキャッシュ済みのストリームを探す（なければ (None, None)）"""
+    for source in _CACHED_STREAM_SOURCES:
+        stream_data = stream_cache.get(source, video_id)
+        if stream_data:
+            return source, stream_data
+    return None, None
+
+def _turbo_stream_data(video):
+    """TurboVideoServiceの結果を他の取得元と同じ形にそろえる"""
+    formats = []
+    if video.get('stream_url'):
+        formats.append({
+            'url': video['stream_url'],
+            'quality': video.get('quality'),
+            'has_audio': video.get('has_audio', True),
+            'audio_url': video.get('audio_url')
+        })
+    seen_urls = {fmt['url'] for fmt in formats}
+    for option in video.get('quality_options') or []:
+        if option.get('url') and option['url'] not in seen_urls:
+            seen_urls.add(option['url'])
+            formats.append({
+                'url': option['url'],
+                'quality': option.get('quality'),
+                'has_audio': option.get('hasAudio', False),
+                'audio_url': None
+            })
+    return {
+        'title': video.get('title', ''),
+        'duration': video.get('duration', 0),
+        'best_url': video.get('stream_url'),
+        'audio_url': video.get('audio_url'),
+        'formats': formats
+    }
+
+@app.route('/api/streams')
+def api_streams():
+    """APIエンドポイント：複数動画のストリームを1回で取得（?ids=a,b,c）
+
+    キャッシュにない動画はTurboの一括取得とInvidiousを並列に使う。
+    結果は動画毎に返し、一部が失敗しても取得できた分は返す。
+    """
+    video_ids = list(dict.fromkeys(
+        video_id.strip() for video_id in request.args.get('ids', '').split(',') if video_id.strip()
+    ))
+    if not video_ids:
+        return jsonify({"success": False, "error": "idsを指定してください。"}), 400
+    if len(video_ids) > STREAM_BATCH_MAX_IDS:
+        return jsonify({"success": False, "error": f"idsは{STREAM_BATCH_MAX_IDS}件までです。"}), 400
+
+    try:
+        streams = {}
+        pending = []
+        for video_id in video_ids:
+            unavailable_reason = negative_cache.get('video', video_id)
+            if unavailable_reason:
+                streams[video_id] = _unavailable_payload(unavailable_reason)
+                continue
+            source, stream_data = _cached_stream(video_id)
+            payload = _stream_payload(stream_data, source) if stream_data else None
+            if payload:
+                streams[video_id] = payload
+            else:
+                pending.append(video_id)
+
+        if pending:
+            deadline = Deadline(STREAM_API_DEADLINE)
+            calls = {
+                f"invidious:{video_id}": (lambda video_id=video_id: invidious.get_stream_urls(video_id, deadline=deadline))
+                for video_id in pending
+            }
+            calls['turbo'] = lambda: turbo_service.batch_get_videos(pending)
+            fetched, _ = gather(calls, deadline=deadline)
+
+            turbo_streams = {}
+            for video in (fetched.get('turbo') or {}).get('videos') or []:
+                video_id = video.get('video_id')
+                if video.get('success') and video_id in pending:
+                    turbo_streams[video_id] = _turbo_stream_data(video)
+                    stream_cache.set('turbo', video_id, turbo_streams[video_id])
+
+            for video_id in pending:
+                payload = None
+                if fetched.get(f"invidious:{video_id}"):
+                    payload = _stream_payload(fetched[f"invidious:{video_id}"], 'invidious')
+                if payload is None and video_id in turbo_streams:
+                    payload = _stream_payload(turbo_streams[video_id], 'turbo')
+                if payload:
+                    streams[video_id] = payload
+                elif deadline.expired():
+                    streams[video_id] = {
+                        "success": False,
+                        "error": "ストリームの取得に時間がかかっています。",
+                        "timeout": True
+                    }
+                else:
+                    streams[video_id] = {"success": False, "error": "動画の取得に失敗しました。"}
+
+        return jsonify({
+            "success": True,
+            "streams": streams,
+            "resolved": sum(1 for result in streams.values() if result["success"]),
+            "requested": len(video_ids)
+        })
+
+    except Exception as e:
+        logging.error(f"一括ストリームAPI エラー: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route('/api/upstream/instances')
+def api_upstream_instances():
+    """上流インスタンスのスコアと試行順を確認するAPI"""
+    prober = get_prober()
+    return jsonify({
+        'success': True,
+        'schedulers': {name: scheduler.snapshot() for name, scheduler in all_schedulers().items()},
+        'prober': prober.status() if prober else None,
+        'breakers': {name: breaker.snapshot() for name, breaker in all_breakers().items()},
+        'rate_limits': {name: limiter.snapshot() for name, limiter in all_rate_limiters().items()},
+        'stream_sources': stream_resolver.snapshot()
+    })
+
+@app.route('/api/upstream/cache')
+def api_upstream_cache():
+    """レスポンスキャッシュの使用量とヒット率を確認するAPI"""
+    return jsonify({
+        'success': True,
+        'response_cache': shared_response_cache.stats(),
+        'negative_cache': negative_cache.stats(),
+        'stream_cache': stream_cache.stats(),
+        'shorts_feeds': shorts_feeds.stats(),
+        'warm_snapshot': get_warm_snapshot().status() if get_warm_snapshot() else None
+    })
+
+@app.route('/api/upstream/ytdl')
+def api_upstream_ytdl():
+    """yt-dlp抽出プロセスの待ち行列の長さと抽出時間を確認するAPI"""
+    return jsonify({
+        'success': True,
+        'extraction': ytdl.stats()
+    })
+
+@app.route('/api/upstream/turbo')
+def api_upstream_turbo():
+    """Node常駐ワーカーの稼働数と応答時間を確認するAPI"""
+    return jsonify({
+        'success': True,
+        'node_workers': node_workers.stats()
+    })
 
+@app.route('/api/upstream/coalescing')
+def api_upstream_coalescing():
+    """同時リクエストの合流件数を確認するAPI（yt-dlpの抽出の合流も含む）"""
+    return jsonify({
+        'success': True,
+        'single_flight': {**all_single_flight_stats(), 'ytdl_extract': ytdl.coalescing_stats()}
+    })
 
 @app.errorhandler(404)
 def not_found(error):
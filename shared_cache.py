@@ -0,0 +1,142 @@
+"""
+ワーカー間共有キャッシュ - 同一ホストのgunicornワーカーが読み書きするSQLite(WAL)ストア
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from config import SHARED_CACHE_PATH, SHARED_CACHE_MAX_ENTRIES
+import json_codec
+
+
+class SharedCacheStore:
+    """L2キャッシュ。エラー時はキャッシュミスとして扱い、リクエストを止めない"""
+
+    def __init__(self, path=SHARED_CACHE_PATH, max_entries=SHARED_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _connect(self):
+        """スレッド・プロセス毎の接続を取得"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, '
+            'expires_at REAL NOT NULL, retain_until REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS responses_retain_until ON responses (retain_until)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS fills ('
+            'key TEXT PRIMARY KEY, owner INTEGER NOT NULL, expires_at REAL NOT NULL)'
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, max_stale=0):
+        """期限切れからmax_stale秒以内の値を (value, stored_at, expires_at, retain_until, size) で返す"""
+        now = time.time()
+        try:
+            row = self._connect().execute(
+                'SELECT value, stored_at, expires_at, retain_until FROM responses '
+                'WHERE key = ? AND expires_at > ? AND retain_until > ?',
+                (key, now - max_stale, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logging.debug(f"共有キャッシュ読み込みエラー: {e}")
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json_codec.loads(row[0]), row[1], row[2], row[3], len(row[0])
+
+    def set(self, key, value, stored_at, expires_at, retain_until=None):
+        try:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (key, value, stored_at, expires_at, retain_until) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, json_codec.dumps(value), stored_at, expires_at,
+                 retain_until if retain_until is not None else expires_at)
+            )
+            self._writes += 1
+            if self._writes % 200 == 0:
+                self._trim(conn)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self.errors += 1
+            logging.debug(f"共有キャッシュ書き込みエラー: {e}")
+
+    def _trim(self, conn):
+        """保持期間切れと上限超過分を削除"""
+        conn.execute('DELETE FROM responses WHERE retain_until <= ?', (time.time(),))
+        conn.execute('DELETE FROM fills WHERE expires_at <= ?', (time.time(),))
+        conn.execute(
+            'DELETE FROM responses WHERE key IN ('
+            'SELECT key FROM responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+
+    def delete(self, key):
+        try:
+            self._connect().execute('DELETE FROM responses WHERE key = ?', (key,))
+        except sqlite3.Error as e:
+            self.errors += 1
+            logging.debug(f"共有キャッシュ削除エラー: {e}")
+
+    def begin_fill(self, key, lease):
+        """上流からの取得権を取る（他ワーカーが取得中ならFalse）"""
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute('DELETE FROM fills WHERE key = ? AND expires_at <= ?', (key, now))
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO fills (key, owner, expires_at) VALUES (?, ?, ?)',
+                (key, os.getpid(), now + lease)
+            )
+            return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            self.errors += 1
+            logging.debug(f"共有キャッシュ取得権エラー: {e}")
+            return True
+
+    def end_fill(self, key):
+        try:
+            self._connect().execute('DELETE FROM fills WHERE key = ? AND owner = ?', (key, os.getpid()))
+        except sqlite3.Error as e:
+            self.errors += 1
+            logging.debug(f"共有キャッシュ取得権解放エラー: {e}")
+
+    def fill_in_progress(self, key):
+        try:
+            row = self._connect().execute(
+                'SELECT 1 FROM fills WHERE key = ? AND expires_at > ?', (key, time.time())
+            ).fetchone()
+            return row is not None
+        except sqlite3.Error:
+            return False
+
+    def stats(self):
+        try:
+            entries = self._connect().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        return {
+            'path': self.path,
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors
+        }
@@ -0,0 +1,344 @@
+"""
+ショート動画フィード - セッション毎に一度だけ組み立てて保存し、カーソルで返す
+
+スワイプ毎の上流検索をなくし、「次」「前」の並びを固定する。
+カーソルが末尾に近づいたら、まだ使っていない検索語で裏で補充する。
+
+sharedを渡すと、組み立て・補充したフィードをワーカー間共有ストアにも保存し、同じセッションの
+リクエストが別のgunicornワーカーに届いても同じ並びを返す（作成・補充は取得権を取った1ワーカーだけが行う）。
+渡さない場合はプロセス内にだけ保存するので、単一ワーカーで動かすこと。
+"""
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from deadline import Deadline
+from fan_out import gather
+from single_flight import get_single_flight
+from config import (SHORTS_FEED_TTL, SHORTS_FEED_MAX_FEEDS, SHORTS_FEED_MAX_VIDEOS, SHORTS_FEED_INITIAL_QUERIES,
+                    SHORTS_FEED_REFILL_QUERIES, SHORTS_FEED_REFILL_THRESHOLD, SHORTS_FEED_BUILD_DEADLINE)
+
+_refill_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='shorts-refill')
+
+# 日本の人気ジャンル
+POPULAR_GENRES = (
+    "面白い", "おもしろ", "爆笑", "ネタ", "コメディ",
+    "料理", "レシピ", "簡単", "DIY", "手作り",
+    "ダンス", "踊り", "TikTok", "バズった",
+    "猫", "犬", "ペット", "動物", "可愛い",
+    "ゲーム", "実況", "攻略", "プレイ",
+    "メイク", "ファッション", "コーデ", "美容",
+    "スポーツ", "サッカー", "野球", "バスケ",
+    "歌ってみた", "弾いてみた", "演奏", "カバー",
+    "vlog", "日常", "ルーティン", "モーニング"
+)
+# 検索語を使い切った後に2ページ目以降を探す語
+EXTRA_KEYWORDS = ("エンタメ", "動物", "グルメ", "スポーツ", "技術")
+
+MIN_DURATION = 10  # 10秒～5分
+MAX_DURATION = 300
+_VIDEOS_PER_QUERY = 6
+_TRENDING_VIDEOS = 15
+# 作成・補充の取得権の有効期間（検索の持ち時間に結果の絞り込みと保存の分の余裕を足す）
+_FILL_LEASE = SHORTS_FEED_BUILD_DEADLINE + 5
+
+
+def new_feed_id():
+    return uuid.uuid4().hex
+
+
+def _video_list(results):
+    """検索・トレンドの結果を動画のリストにそろえる"""
+    if isinstance(results, list):
+        return results
+    if isinstance(results, dict) and results.get('success', True):
+        return results.get('videos', [])
+    return []
+
+
+def _shared_key(feed_id):
+    return f"shorts_feed/{feed_id}"
+
+
+class _Feed:
+    def __init__(self, feed_id, queries, ttl):
+        self.feed_id = feed_id
+        self.queries = queries  # [(検索語, ページ)]
+        self.next_query = 0
+        self.videos = []
+        self.positions = {}  # 動画ID -> 位置
+        self.frontier = 0  # 返した中で最も先の位置
+        self.lock = threading.Lock()
+        self.refill_lock = threading.Lock()
+        self.expires_at = time.monotonic() + ttl
+        self.saved_at = 0.0  # 共有ストアに最後に保存した時刻
+
+    def has_more_queries(self):
+        return self.next_query < len(self.queries) and len(self.videos) < SHORTS_FEED_MAX_VIDEOS
+
+    def state(self):
+        """共有ストアに保存する内容（呼び出し側でlockを取ること）"""
+        return {'queries': self.queries, 'next_query': self.next_query, 'videos': self.videos}
+
+    def load_state(self, state):
+        """共有ストアの内容が手元より進んでいれば置き換える（呼び出し側でlockを取ること）"""
+        if len(state['videos']) < len(self.videos) or (
+                len(state['videos']) == len(self.videos) and state['next_query'] <= self.next_query):
+            return False
+        self.queries = [tuple(query) for query in state['queries']]
+        self.next_query = state['next_query']
+        self.videos = state['videos']
+        self.positions = {video['videoId']: position for position, video in enumerate(self.videos)}
+        return True
+
+
+class ShortsFeedStore:
+    def __init__(self, invidious, user_prefs, ttl=SHORTS_FEED_TTL, max_feeds=SHORTS_FEED_MAX_FEEDS, shared=None):
+        self.invidious = invidious
+        self.user_prefs = user_prefs
+        self.ttl = ttl
+        self.max_feeds = max_feeds
+        self.shared = shared
+        self._feeds = OrderedDict()  # フィードID -> _Feed
+        self._lock = threading.Lock()
+        self._flight = get_single_flight('shorts_feed')
+        self.built = 0
+        self.refills = 0
+
+    def _build_queries(self):
+        """好みのチャンネル → 推奨キーワード → 人気ジャンル → 追加キーワードの2ページ目以降の順"""
+        queries = []
+        for channel_name, _ in self.user_prefs.get_preferred_channels()[:5]:  # 上位5チャンネル
+            queries.append(f"channel:{channel_name}")
+        recommended_keywords = self.user_prefs.get_recommendation_keywords()
+        logging.info(f"推奨キーワード: {recommended_keywords[:5]}")
+        queries.extend(recommended_keywords[:15])
+        queries.extend(POPULAR_GENRES)
+        queries = [(query, 1) for query in dict.fromkeys(queries)]
+        queries.extend((keyword, page) for page in (2, 3) for keyword in EXTRA_KEYWORDS)
+        return queries
+
+    def _collect(self, feed, count, include_trending):
+        """未使用の検索語をcount件並列に実行し、条件に合う動画をフィードの末尾に追加"""
+        with feed.lock:
+            queries = feed.queries[feed.next_query:feed.next_query + count]
+            feed.next_query += len(queries)
+
+        calls = {
+            f"search:{query}:{page}": (lambda query=query, page=page: self.invidious.search_videos(query, page=page))
+            for query, page in queries
+        }
+        if include_trending:
+            calls['trending'] = lambda: self.invidious.get_trending_videos(region='JP')
+        results, _ = gather(calls, deadline=Deadline(SHORTS_FEED_BUILD_DEADLINE))
+
+        # 結果は検索語の順に見るので、同じ結果からは同じ並びになる
+        sources = [(name, _VIDEOS_PER_QUERY) for name in calls if name != 'trending']
+        if include_trending:
+            sources.append(('trending', _TRENDING_VIDEOS))
+        candidates = []
+        seen = set()
+        for name, limit in sources:
+            for video in _video_list(results.get(name))[:limit]:
+                video_id = video.get('videoId')
+                duration = video.get('lengthSeconds', 0) or 0
+                if not video_id or video_id in seen or not MIN_DURATION <= duration <= MAX_DURATION:
+                    continue
+                if self.user_prefs.should_recommend_video(video):
+                    seen.add(video_id)
+                    candidates.append(video)
+
+        # 追加分の中では短い動画を優先しつつ、同じ長さの並びは混ぜる
+        candidates.sort(key=lambda video: (video.get('lengthSeconds', 0), random.random()))
+        added = 0
+        with feed.lock:
+            for video in candidates:
+                if len(feed.videos) >= SHORTS_FEED_MAX_VIDEOS:
+                    break
+                if video['videoId'] in feed.positions:
+                    continue
+                feed.positions[video['videoId']] = len(feed.videos)
+                feed.videos.append(video)
+                added += 1
+        return added
+
+    def _save(self, feed):
+        """共有ストアにフィードを保存（最後の作成・補充からttl秒保持）"""
+        if self.shared is None:
+            return
+        with feed.lock:
+            state = feed.state()
+        now = time.time()
+        feed.saved_at = now
+        self.shared.set(_shared_key(feed.feed_id), state, now, now + self.ttl)
+
+    def _sync(self, feed):
+        """他のワーカーが共有ストアに保存した作成・補充の結果を取り込む"""
+        if self.shared is None:
+            return False
+        entry = self.shared.get(_shared_key(feed.feed_id))
+        if entry is None:
+            return False
+        with feed.lock:
+            feed.saved_at = max(feed.saved_at, entry[1])
+            return feed.load_state(entry[0])
+
+    def _wait_for_fill(self, feed_id):
+        """他のワーカーの作成・補充が終わるのを待つ"""
+        wait_until = time.monotonic() + _FILL_LEASE
+        while time.monotonic() < wait_until and self.shared.fill_in_progress(_shared_key(feed_id)):
+            time.sleep(0.05)
+
+    def _remember(self, feed):
+        with self._lock:
+            self._feeds[feed.feed_id] = feed
+            while len(self._feeds) > self.max_feeds:
+                self._feeds.popitem(last=False)
+        return feed
+
+    def _build(self, feed_id):
+        """共有ストアにあれば読み込み、なければ作成する（他のワーカーが作成中なら待って読み込む）"""
+        feed = _Feed(feed_id, [], self.ttl)
+        if self._sync(feed):
+            return self._remember(feed)
+        key = _shared_key(feed_id)
+        if self.shared is not None and not self.shared.begin_fill(key, _FILL_LEASE):
+            self._wait_for_fill(feed_id)
+            if self._sync(feed):
+                return self._remember(feed)
+        try:
+            feed.queries = self._build_queries()
+            added = self._collect(feed, SHORTS_FEED_INITIAL_QUERIES, include_trending=True)
+            self._save(feed)
+        finally:
+            if self.shared is not None:
+                self.shared.end_fill(key)
+        logging.info(f"ショート動画フィード {feed_id[:8]} を {added} 件で作成")
+        with self._lock:
+            self.built += 1
+        return self._remember(feed)
+
+    def get(self, feed_id):
+        """フィードを返す（なければ作る。同じIDの同時作成は1回にまとめる）"""
+        with self._lock:
+            feed = self._feeds.get(feed_id)
+            if feed is not None and feed.expires_at > time.monotonic():
+                self._feeds.move_to_end(feed_id)
+                feed.expires_at = time.monotonic() + self.ttl
+            else:
+                self._feeds.pop(feed_id, None)
+                feed = None
+        if feed is None:
+            return self._flight.do(feed_id, lambda: self._build(feed_id))
+        # 使われている間は共有ストアの保持期間も延ばす（補充がなくても他のワーカーから消えないように）
+        if self.shared is not None and time.time() - feed.saved_at > self.ttl / 2:
+            # 他のワーカーが補充した分を古い内容で上書きしないよう、取り込んでから保存する
+            self._sync(feed)
+            self._save(feed)
+        return feed
+
+    def drop(self, feed_id):
+        with self._lock:
+            self._feeds.pop(feed_id, None)
+        if self.shared is not None:
+            self.shared.delete(_shared_key(feed_id))
+
+    def _refill(self, feed, force=False):
+        """補充が必要なら検索語を追加で実行（補充中なら終わるまで待ってから判断）"""
+        with feed.refill_lock:
+            # 他のワーカーが補充済みならその結果を使う
+            self._sync(feed)
+            with feed.lock:
+                remaining = len(feed.videos) - feed.frontier - 1
+            if not feed.has_more_queries() or (not force and remaining > SHORTS_FEED_REFILL_THRESHOLD):
+                return
+            key = _shared_key(feed.feed_id)
+            if self.shared is not None and not self.shared.begin_fill(key, _FILL_LEASE):
+                # 他のワーカーが補充中（裏の補充なら任せ、続きが要るなら終わるのを待って取り込む）
+                if force:
+                    self._wait_for_fill(feed.feed_id)
+                    self._sync(feed)
+                return
+            try:
+                added = self._collect(feed, SHORTS_FEED_REFILL_QUERIES, include_trending=False)
+                self._save(feed)
+            finally:
+                if self.shared is not None:
+                    self.shared.end_fill(key)
+            with self._lock:
+                self.refills += 1
+            logging.info(f"ショート動画フィードを {added} 件補充")
+
+    def _advance(self, feed, position):
+        """返した位置を記録し、末尾に近ければ裏で補充する"""
+        with feed.lock:
+            feed.frontier = max(feed.frontier, position)
+            near_end = len(feed.videos) - feed.frontier - 1 <= SHORTS_FEED_REFILL_THRESHOLD
+        if near_end and feed.has_more_queries() and not feed.refill_lock.locked():
+            _refill_executor.submit(self._refill, feed)
+
+    def page(self, feed_id, cursor=0, limit=20):
+        """cursorからlimit件を返す: (動画, 次のカーソル, まだ続くか)"""
+        feed = self.get(feed_id)
+        cursor = max(0, cursor)
+        if cursor + limit > len(feed.videos) and feed.has_more_queries():
+            self._refill(feed, force=True)
+        with feed.lock:
+            videos = feed.videos[cursor:cursor + limit]
+            next_cursor = cursor + len(videos)
+            total = len(feed.videos)
+        if videos:
+            self._advance(feed, next_cursor - 1)
+        return videos, next_cursor, next_cursor < total or feed.has_more_queries()
+
+    def neighbour(self, feed_id, video_id, step):
+        """video_idの前後（step = 1 / -1）の動画を返す: (位置, 動画, その先もあるか)
+
+        フィードにない動画からの「次」は先頭を返す。末尾では補充を待ってから判断する。
+        """
+        feed = self.get(feed_id)
+        if video_id not in feed.positions:
+            # 他のワーカーが補充した分から返した動画かもしれない
+            self._sync(feed)
+        with feed.lock:
+            position = feed.positions.get(video_id, -1) + step
+            at_end = position >= len(feed.videos)
+        if step > 0 and at_end and feed.has_more_queries():
+            self._refill(feed, force=True)
+        with feed.lock:
+            if position < 0 or position >= len(feed.videos):
+                return position, None, False
+            video = feed.videos[position]
+            total = len(feed.videos)
+        if step > 0:
+            self._advance(feed, position)
+            return position, video, position + 1 < total or feed.has_more_queries()
+        return position, video, position > 0
+
+    def size(self, feed_id):
+        """フィードに入っている動画の件数"""
+        feed = self.get(feed_id)
+        with feed.lock:
+            return len(feed.videos)
+
+    def position(self, feed_id, video_id):
+        """フィード内のvideo_idの位置（含まれなければ-1）"""
+        feed = self.get(feed_id)
+        if video_id not in feed.positions:
+            self._sync(feed)
+        with feed.lock:
+            return feed.positions.get(video_id, -1)
+
+    def stats(self):
+        with self._lock:
+            feeds = list(self._feeds.values())
+            return {
+                'shared': self.shared is not None,
+                'feeds': len(feeds),
+                'videos': sum(len(feed.videos) for feed in feeds),
+                'built': self.built,
+                'refills': self.refills
+            }
@@ -0,0 +1,87 @@
+"""
+ストリームURLキャッシュ - 解決済みのストリームを動画ID×取得元毎に保存する
+
+googlevideoの署名付きURLは expire パラメータに失効時刻を持つので、そこから安全マージンと
+動画の長さ（再生中に失効しないように）を引いた時間だけ保持する。
+"""
+import time
+from urllib.parse import urlsplit, parse_qs
+from response_cache import ResponseCache
+from shared_cache import SharedCacheStore
+from config import (
+    SHARED_CACHE_ENABLED, STREAM_CACHE_MAX_ENTRIES, STREAM_CACHE_MAX_BYTES,
+    STREAM_CACHE_SAFETY_MARGIN, STREAM_CACHE_DEFAULT_TTL, STREAM_CACHE_MAX_TTL
+)
+
+
+def url_expiry(url):
+    """URLの失効時刻（UNIX秒）。?expire=… と /expire/…/ の両方の形式に対応"""
+    if not url:
+        return None
+    try:
+        parts = urlsplit(url)
+        values = parse_qs(parts.query).get('expire')
+        if values:
+            return int(values[0])
+        segments = parts.path.split('/')
+        if 'expire' in segments:
+            return int(segments[segments.index('expire') + 1])
+    except (ValueError, IndexError):
+        pass
+    return None
+
+
+def _stream_urls(stream_data):
+    yield stream_data.get('best_url')
+    yield stream_data.get('audio_url')
+    for fmt in stream_data.get('formats') or []:
+        yield fmt.get('url')
+        yield fmt.get('audio_url')
+
+
+class StreamCache:
+    def __init__(self, cache=None, safety_margin=STREAM_CACHE_SAFETY_MARGIN,
+                 default_ttl=STREAM_CACHE_DEFAULT_TTL, max_ttl=STREAM_CACHE_MAX_TTL):
+        self._cache = cache or ResponseCache(max_entries=STREAM_CACHE_MAX_ENTRIES,
+                                             max_bytes=STREAM_CACHE_MAX_BYTES)
+        self.safety_margin = safety_margin
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+
+    def ttl_for(self, stream_data):
+        """最も早く失効するURLに合わせた保持秒数（保持しない場合は0以下）"""
+        expiries = [expiry for expiry in map(url_expiry, _stream_urls(stream_data)) if expiry]
+        if not expiries:
+            return self.default_ttl
+        try:
+            duration = int(stream_data.get('duration') or 0)
+        except (TypeError, ValueError):
+            duration = 0
+        ttl = min(expiries) - time.time() - self.safety_margin - duration
+        return min(self.max_ttl, int(ttl))
+
+    def get(self, source, video_id):
+        return self._cache.get(f"streams/{source}/{video_id}")
+
+    def set(self, source, video_id, stream_data):
+        """保存できたらTrue（失効間近のURLは保存しない）"""
+        if not stream_data:
+            return False
+        ttl = self.ttl_for(stream_data)
+        if ttl <= 0:
+            return False
+        self._cache.set(f"streams/{source}/{video_id}", stream_data, ttl=ttl)
+        return True
+
+    def delete(self, source, video_id):
+        self._cache.delete(f"streams/{source}/{video_id}")
+
+    def stats(self):
+        return self._cache.stats()
+
+
+# ワーカー内で共有するストリームURLキャッシュ（L2はレスポンスキャッシュと同じストアを使う）
+stream_cache = StreamCache(ResponseCache(
+    max_entries=STREAM_CACHE_MAX_ENTRIES, max_bytes=STREAM_CACHE_MAX_BYTES,
+    l2=SharedCacheStore() if SHARED_CACHE_ENABLED else None
+))
@@ -0,0 +1,150 @@
+"""
+ストリーム解決 - 複数の取得元を時間差で競争させ、最初に使えるフォーマット一覧を返す
+
+取得元の開始順は、動画の種類（ショート・通常・長尺・ライブ）毎の直近の成功率とレイテンシで決める。
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from hedged_request import hedged_call, HedgedRequestError, HedgeAbort
+from deadline import DeadlineExceeded
+from negative_cache import negative_cache
+from config import SCHEDULER_EWMA_ALPHA, STREAM_RACE_DELAY, STREAM_RACE_WORKERS, STREAM_API_DEADLINE
+
+# 取得元の中でヘッジリクエストを使うため、ヘッジ用とは別のプールで走らせる
+_executor = ThreadPoolExecutor(max_workers=STREAM_RACE_WORKERS, thread_name_prefix='stream-race')
+
+_PRIOR_SUCCESS_RATE = 0.7
+
+
+class UnusableStreamError(Exception):
+    """取得元が使えるストリームを返さなかった"""
+
+
+def video_kind(video_info):
+    """成功率を分けて記録する動画の種類"""
+    if not video_info:
+        return 'any'
+    if video_info.get('liveNow'):
+        return 'live'
+    try:
+        length = int(video_info.get('lengthSeconds') or 0)
+    except (TypeError, ValueError):
+        return 'any'
+    if 0 < length <= 60:
+        return 'short'
+    if length > 1200:
+        return 'long'
+    return 'regular'
+
+
+def is_usable(stream_data):
+    return bool(stream_data) and bool(stream_data.get('best_url') or stream_data.get('formats'))
+
+
+class _SourceStats:
+    def __init__(self, index, expected_latency):
+        self.index = index
+        self.ewma_latency = expected_latency
+        self.success_rate = None
+        self.wins = 0
+        self.successes = 0
+        self.failures = 0
+
+    def score(self):
+        """1回成功するまでの期待時間（小さいほど先に開始）"""
+        success_rate = self.success_rate if self.success_rate is not None else _PRIOR_SUCCESS_RATE
+        return self.ewma_latency / max(success_rate, 0.05) + self.index * 0.001
+
+
+class StreamResolver:
+    def __init__(self, sources, race_delay=STREAM_RACE_DELAY, alpha=SCHEDULER_EWMA_ALPHA):
+        # sources: [(名前, fetch(video_id, deadline), 想定レイテンシ秒)] を既定の優先順で
+        self.sources = {name: fetch for name, fetch, _ in sources}
+        self._expected = {name: (index, latency) for index, (name, _, latency) in enumerate(sources)}
+        self.race_delay = race_delay
+        self.alpha = alpha
+        self._stats = {}  # (種類, 名前) -> _SourceStats
+        self._lock = threading.Lock()
+
+    def _source_stats(self, kind, name):
+        stats = self._stats.get((kind, name))
+        if stats is None:
+            index, latency = self._expected[name]
+            stats = self._stats[(kind, name)] = _SourceStats(index, latency)
+        return stats
+
+    def _record(self, kind, name, ok, latency=None):
+        with self._lock:
+            stats = self._source_stats(kind, name)
+            if ok:
+                stats.successes += 1
+                stats.ewma_latency = (1 - self.alpha) * stats.ewma_latency + self.alpha * latency
+            else:
+                stats.failures += 1
+            value = 1.0 if ok else 0.0
+            stats.success_rate = value if stats.success_rate is None else (
+                (1 - self.alpha) * stats.success_rate + self.alpha * value)
+
+    def order(self, kind):
+        with self._lock:
+            return sorted(self.sources, key=lambda name: self._source_stats(kind, name).score())
+
+    def resolve(self, video_id, video_info=None, deadline=None):
+        """(取得元の名前, ストリーム) を返す（どれも使えない・持ち時間切れ・再生不可なら (None, None)）"""
+        if negative_cache.get('video', video_id):
+            return None, None
+        kind = video_kind(video_info)
+
+        def fetch(name, timeout):
+            started_at = time.monotonic()
+            try:
+                stream_data = self.sources[name](video_id, deadline)
+            except DeadlineExceeded as e:
+                # 持ち時間切れは取得元の失敗として数えず、競争中の他の取得元も止めない
+                raise UnusableStreamError(f"{name} が持ち時間内に応答しませんでした") from e
+            except HedgeAbort:
+                # 再生不可と確定したら残りの取得元も中断する（取得元の失敗としては数えない）
+                raise
+            except Exception:
+                self._record(kind, name, False)
+                raise
+            if not is_usable(stream_data):
+                self._record(kind, name, False)
+                raise UnusableStreamError(f"{name} から使えるストリームを取得できませんでした")
+            self._record(kind, name, True, time.monotonic() - started_at)
+            return stream_data
+
+        order = self.order(kind)
+        try:
+            name, stream_data = hedged_call(
+                order, fetch,
+                fanout=len(order),
+                hedge_delay=self.race_delay,
+                deadline=deadline.remaining() if deadline is not None else STREAM_API_DEADLINE,
+                executor=_executor
+            )
+        except HedgedRequestError as e:
+            logging.warning(f"ストリーム取得元がすべて失敗: {video_id} ({kind}): {e.last_error or e}")
+            return None, None
+        except HedgeAbort as e:
+            logging.warning(f"ストリーム取得を中断: {video_id} ({kind}): {e}")
+            return None, None
+        with self._lock:
+            self._source_stats(kind, name).wins += 1
+        return name, stream_data
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for (kind, name), stats in sorted(self._stats.items(), key=lambda item: item[1].score()):
+                result.setdefault(kind, {})[name] = {
+                    'score': round(stats.score(), 3),
+                    'ewma_latency': round(stats.ewma_latency, 3),
+                    'success_rate': round(stats.success_rate, 3) if stats.success_rate is not None else None,
+                    'wins': stats.wins,
+                    'successes': stats.successes,
+                    'failures': stats.failures
+                }
+            return result
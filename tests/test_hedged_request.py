@@ -0,0 +1,126 @@
+"""
+ヘッジ付きリクエストのテスト - 遅延を入れたローカルのHTTPサーバーをInvidiousインスタンスの代わりに使う
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from hedged_request import HedgedRequestError
+from invidious_service import InvidiousService
+
+# スレッドの起動やローカル接続の揺れを吸収する余裕
+MARGIN = 0.5
+
+
+class StandIn:
+    """指定の遅延・ステータスで応答するスタンドインのインスタンス"""
+
+    def __init__(self, name, delay=0.0, status=200):
+        self.name = name
+        self.delay = delay
+        self.status = status
+        self.hits = 0
+        self._lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stand_in._lock:
+                    stand_in.hits += 1
+                time.sleep(stand_in.delay)
+                body = json.dumps({'instance': stand_in.name}).encode('utf-8')
+                try:
+                    self.send_response(stand_in.status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    # 打ち切られた候補はクライアント側が先に切断している
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stand_ins():
+    created = []
+
+    def make(name, delay=0.0, status=200):
+        stand_in = StandIn(name, delay, status)
+        created.append(stand_in)
+        return stand_in
+
+    yield make
+    for stand_in in created:
+        stand_in.close()
+
+
+def make_service(stand_ins, **kwargs):
+    service = InvidiousService(instances=[stand_in.url for stand_in in stand_ins], **kwargs)
+    # 設定順のまま試行させる
+    service.scheduler.exploration_rate = 0
+    return service
+
+
+def test_fast_instance_wins_within_hedge_delay(stand_ins):
+    slow = stand_ins('slow', delay=3.0)
+    fast = stand_ins('fast')
+    service = make_service([slow, fast], hedge_fanout=2, hedge_delay=0.2, hedge_deadline=5)
+
+    started_at = time.monotonic()
+    data = service._fetch_and_store('stats', 'stats', None)
+
+    assert data == {'instance': 'fast'}
+    assert time.monotonic() - started_at < 0.2 + MARGIN
+    assert slow.hits == 1 and fast.hits == 1
+
+
+def test_fanout_caps_instances_hit(stand_ins):
+    instances = [stand_ins(f"slow-{i}", delay=1.0) for i in range(4)]
+    service = make_service(instances, hedge_fanout=2, hedge_delay=0.05, hedge_deadline=0.6)
+
+    with pytest.raises(Exception) as error:
+        service._fetch_and_store('stats', 'stats', None)
+    assert isinstance(error.value.__cause__, HedgedRequestError)
+
+    time.sleep(MARGIN)
+    assert [stand_in.hits for stand_in in instances] == [1, 1, 0, 0]
+
+
+def test_deadline_aborts_remaining_candidates(stand_ins):
+    instances = [stand_ins(f"slow-{i}", delay=2.0) for i in range(4)]
+    service = make_service(instances, hedge_fanout=4, hedge_delay=0.2, hedge_deadline=0.3)
+
+    started_at = time.monotonic()
+    with pytest.raises(Exception):
+        service._fetch_and_store('stats', 'stats', None)
+    assert time.monotonic() - started_at < 0.3 + MARGIN
+
+    # 制限時間までに投げた2件だけで、残りの候補には問い合わせない
+    time.sleep(MARGIN)
+    assert [stand_in.hits for stand_in in instances] == [1, 1, 0, 0]
+
+
+def test_first_success_wins_over_errors(stand_ins):
+    broken = stand_ins('broken', status=500)
+    missing = stand_ins('missing', status=404)
+    healthy = stand_ins('healthy', delay=0.1)
+    service = make_service([broken, missing, healthy], hedge_fanout=3, hedge_delay=0.05, hedge_deadline=5)
+
+    data = service._fetch_and_store('stats', 'stats', None)
+
+    assert data == {'instance': 'healthy'}
+    assert broken.hits == 1 and missing.hits == 1 and healthy.hits == 1
@@ -206,6 +206,53 @@ class TurboVideoService {
     }
 }
 
+// 常駐ワーカー: 標準入力から1行1件のJSONリクエストを受け取り、同じidを付けて1行のJSONで返す
+// {"id": 1, "method": "stream", "params": {"videoId": "...", "quality": "720p"}}
+//   -> {"id": 1, "result": {...}} または {"id": 1, "error": "..."}
+function runWorker(service) {
+    const readline = require('readline');
+
+    // 応答以外の出力で標準出力のプロトコルが崩れないよう、ログはすべて標準エラーへ
+    console.log = console.error;
+    console.info = console.error;
+
+    const send = (message) => process.stdout.write(JSON.stringify(message) + '\n');
+    const handlers = {
+        stream: (params) => service.getVideoStream(params.videoId, params.quality),
+        batch: (params) => service.batchGetVideos(params.videoIds, params.quality),
+        search: (params) => service.searchVideos(params.query, params.maxResults || 20),
+        stats: () => service.getCacheStats()
+    };
+
+    const rl = readline.createInterface({ input: process.stdin });
+    rl.on('line', (line) => {
+        if (!line.trim()) return;
+
+        let request;
+        try {
+            request = JSON.parse(line);
+        } catch (error) {
+            console.error('Worker request parse error:', error.message);
+            return;
+        }
+
+        const handler = handlers[request.method];
+        if (!handler) {
+            send({ id: request.id, error: `Unknown method: ${request.method}` });
+            return;
+        }
+
+        // 複数のリクエストを待たずに並行して処理する
+        Promise.resolve()
+            .then(() => handler(request.params || {}))
+            .then(result => send({ id: request.id, result: result }))
+            .catch(error => send({ id: request.id, error: error.message }));
+    });
+
+    // 親プロセスが標準入力を閉じたら終了する
+    rl.on('close', () => process.exit(0));
+}
+
 // CLI インターフェース
 if (require.main === module) {
     const service = new TurboVideoService();
@@ -240,8 +287,12 @@ if (require.main === module) {
                 });
             break;
 
+        case 'worker':
+            runWorker(service);
+            break;
+
         default:
-            console.error('Usage: node turbo_video_service.js [stream|batch|search] [args...]');
+            console.error('Usage: node turbo_video_service.js [stream|batch|search|worker] [args...]');
             process.exit(1);
     }
 }
@@ -1,33 +1,33 @@
 """
 超高速動画取得サービス - ytdl-core並列処理版
 """
-import subprocess
-import json
 import logging
 import asyncio
 import concurrent.futures
 from typing import List, Dict, Optional
+from single_flight import get_single_flight
+from node_worker import NodeWorkerPool, NodeWorkerTimeout
+from config import TURBO_NODE_WORKERS
+
+# Nodeを起動したままにして呼び出し毎の起動とytdl-coreの読み込みを省く（最初の呼び出しで起動）
+node_workers = NodeWorkerPool('turbo-node', 'turbo_video_service.js', TURBO_NODE_WORKERS)
 
 class TurboVideoService:
     def __init__(self):
-        self.node_script = 'turbo_video_service.js'
+        self.node_script = node_workers.script
         self.max_workers = 10  # 並列処理数
+        self._flight = get_single_flight('turbo')
         
     def get_video_stream_720p(self, video_id: str) -> Dict:
-        """720p音声付きストリームを優先取得"""
+        """720p音声付きストリームを優先取得（同じ動画の同時呼び出しは1回にまとめる）"""
+        return self._flight.do(f"stream:{video_id}", lambda: self._get_video_stream_720p(video_id))
+    
+    def _get_video_stream_720p(self, video_id: str) -> Dict:
         try:
-            result = subprocess.run([
-                'node', self.node_script, 'stream', video_id, '720p'
-            ], capture_output=True, text=True, timeout=10)
-            
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                return self._format_stream_response(data)
-            else:
-                logging.error(f"Turbo stream error: {result.stderr}")
-                return {'success': False, 'error': result.stderr}
+            data = node_workers.call('stream', {'videoId': video_id, 'quality': '720p'}, timeout=10)
+            return self._format_stream_response(data)
                 
-        except subprocess.TimeoutExpired:
+        except NodeWorkerTimeout:
             logging.error(f"Turbo stream timeout for {video_id}")
             return {'success': False, 'error': 'Stream timeout'}
         except Exception as e:
@@ -36,29 +36,24 @@ class TurboVideoService:
     
     def batch_get_videos(self, video_ids: List[str]) -> Dict:
         """複数動画を並列で高速取得"""
+        key = f"batch:{','.join(sorted(video_ids))}"
+        return self._flight.do(key, lambda: self._batch_get_videos(video_ids))
+    
+    def _batch_get_videos(self, video_ids: List[str]) -> Dict:
         try:
-            video_ids_str = ','.join(video_ids)
-            result = subprocess.run([
-                'node', self.node_script, 'batch', video_ids_str, '720p'
-            ], capture_output=True, text=True, timeout=30)
-            
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                if data.get('success'):
-                    formatted_videos = []
-                    for video in data.get('videos', []):
-                        formatted_videos.append(self._format_stream_response(video))
-                    return {
-                        'success': True,
-                        'videos': formatted_videos,
-                        'count': len(formatted_videos)
-                    }
-                return data
-            else:
-                logging.error(f"Batch turbo error: {result.stderr}")
-                return {'success': False, 'error': result.stderr}
+            data = node_workers.call('batch', {'videoIds': list(video_ids), 'quality': '720p'}, timeout=30)
+            if data.get('success'):
+                formatted_videos = []
+                for video in data.get('videos', []):
+                    formatted_videos.append(self._format_stream_response(video))
+                return {
+                    'success': True,
+                    'videos': formatted_videos,
+                    'count': len(formatted_videos)
+                }
+            return data
                 
-        except subprocess.TimeoutExpired:
+        except NodeWorkerTimeout:
             logging.error("Batch turbo timeout")
             return {'success': False, 'error': 'Batch timeout'}
         except Exception as e:
@@ -67,19 +62,14 @@ class TurboVideoService:
     
     def turbo_search(self, query: str, max_results: int = 20) -> Dict:
         """高速検索"""
+        key = f"search:{max_results}:{query}"
+        return self._flight.do(key, lambda: self._turbo_search(query, max_results))
+    
+    def _turbo_search(self, query: str, max_results: int) -> Dict:
         try:
-            result = subprocess.run([
-                'node', self.node_script, 'search', query, str(max_results)
-            ], capture_output=True, text=True, timeout=15)
-            
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                return data
-            else:
-                logging.error(f"Turbo search error: {result.stderr}")
-                return {'success': False, 'error': result.stderr}
+            return node_workers.call('search', {'query': query, 'maxResults': max_results}, timeout=15)
                 
-        except subprocess.TimeoutExpired:
+        except NodeWorkerTimeout:
             logging.error("Turbo search timeout")
             return {'success': False, 'error': 'Search timeout'}
         except Exception as e:
@@ -0,0 +1,105 @@
+"""
+上流HTTPクライアント共通層 - ホスト毎のkeep-aliveコネクションプールを全サービスで共有
+"""
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import (
+    REQUEST_TIMEOUT, UPSTREAM_POOL_HOSTS, UPSTREAM_POOL_SIZE,
+    UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_CONNECT_RETRIES
+)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+
+class UpstreamHTTPError(Exception):
+    """上流が200以外のステータスを返した（detailはエラー本文の要約）"""
+
+    def __init__(self, status_code, url=None, retry_after=None, detail=None):
+        super().__init__(f"HTTP {status_code}: {detail}" if detail else f"HTTP {status_code}")
+        self.status_code = status_code
+        self.url = url
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+_session = None
+_session_pid = None
+_lock = threading.Lock()
+
+
+def _build_session():
+    """接続プールと再試行設定済みのセッションを作成"""
+    # 再試行は接続確立の失敗（古いkeep-alive接続の切断など）のみ。
+    # 読み込みタイムアウトやHTTPエラーはフェイルオーバー側で扱う
+    retry = Retry(
+        total=UPSTREAM_CONNECT_RETRIES,
+        connect=UPSTREAM_CONNECT_RETRIES,
+        read=0,
+        status=0,
+        backoff_factor=0.1,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=UPSTREAM_POOL_HOSTS,
+        pool_maxsize=UPSTREAM_POOL_SIZE,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+def get_session():
+    """プロセス共有のセッションを取得（gunicornのfork後はワーカー毎に作り直す）"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def get(url, params=None, timeout=REQUEST_TIMEOUT, **kwargs):
+    """共有セッションでGETリクエスト（接続とレスポンス読み込みでタイムアウトを分ける）"""
+    connect_timeout = min(UPSTREAM_CONNECT_TIMEOUT, timeout)
+    return get_session().get(url, params=params, timeout=(connect_timeout, timeout), **kwargs)
+
+
+def raise_for_status(response):
+    """200以外ならUpstreamHTTPErrorを送出"""
+    if response.status_code != 200:
+        raise UpstreamHTTPError(response.status_code, response.url, retry_after(response), _error_detail(response))
+    return response
+
+
+def is_instance_failure(status_code):
+    """インスタンス側の失敗とみなすステータスか（5xxと429。404などの「存在しない」回答は正常な応答）"""
+    return status_code == 429 or status_code >= 500
+
+
+def retry_after(response):
+    """Retry-Afterヘッダーの秒数（ないか日付形式ならNone）"""
+    value = response.headers.get('Retry-After')
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _error_detail(response):
+    """エラーレスポンスの本文から理由を取り出す（Invidiousは {"error": "..."} を返す）"""
+    try:
+        data = response.json()
+        if isinstance(data, dict) and data.get('error'):
+            return str(data['error'])[:200]
+    except ValueError:
+        pass
+    return None
@@ -0,0 +1,162 @@
+"""
+ウォームスナップショット - インスタンスのスコアとよく使うキャッシュをファイルに保存し、再起動後に読み込む
+"""
+import atexit
+import fcntl
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from cache_policy import endpoint_family
+from instance_scheduler import all_schedulers
+from response_cache import shared_response_cache
+from config import (
+    WARM_SNAPSHOT_PATH, WARM_SNAPSHOT_INTERVAL, WARM_SNAPSHOT_MAX_AGE,
+    WARM_SNAPSHOT_FAMILIES, WARM_SNAPSHOT_MAX_ENTRIES
+)
+
+
+class WarmSnapshot:
+    """保存は定期的とプロセス終了時。キャッシュは元の期限のまま復元するので古い値は読み込まれない
+
+    保存はロックを取れた1ワーカーだけが行う（読み込みは全ワーカー）。
+    """
+
+    def __init__(self, cache=shared_response_cache, path=WARM_SNAPSHOT_PATH,
+                 interval=WARM_SNAPSHOT_INTERVAL, max_age=WARM_SNAPSHOT_MAX_AGE,
+                 families=WARM_SNAPSHOT_FAMILIES, max_entries=WARM_SNAPSHOT_MAX_ENTRIES):
+        self.cache = cache
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self.families = set(families)
+        self.max_entries = max_entries
+        self.lock_path = f"{path}.lock"
+        self.is_leader = False
+        self.last_save = None
+        self.last_load = None
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _include(self, key):
+        return endpoint_family(key.split('?', 1)[0]) in self.families
+
+    def _try_become_leader(self):
+        """ファイルロックで保存担当ワーカーを1つに絞る（担当が終了したら次の保存で引き継ぐ）"""
+        if self._lock_file is not None:
+            return True
+        try:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            lock_file = open(self.lock_path, 'a')
+        except OSError as e:
+            logging.warning(f"スナップショットのロックを開けません: {e}")
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.is_leader = True
+        logging.info(f"スナップショットの保存を担当します (pid={os.getpid()})")
+        return True
+
+    def save(self):
+        """スコアとキャッシュを一時ファイルに書いてから置き換える（保存担当でなければ何もしない）"""
+        if not self._try_become_leader():
+            return False
+        started_at = time.time()
+        data = {
+            'at': started_at,
+            'schedulers': {name: scheduler.export_state() for name, scheduler in all_schedulers().items()},
+            'cache': self.cache.export_entries(self._include, self.max_entries)
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            logging.warning(f"スナップショットの保存に失敗: {e}")
+            return False
+        self.last_save = {
+            'at': started_at,
+            'entries': len(data['cache']),
+            'duration': round(time.time() - started_at, 3)
+        }
+        return True
+
+    def load(self):
+        """保存済みのスナップショットを復元（古すぎるスコアと保持期間切れのキャッシュは捨てる）"""
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, EOFError, ValueError):
+            return False
+
+        saved_at = data.get('at', 0)
+        age = time.time() - saved_at
+        restored_instances = 0
+        if age <= self.max_age:
+            schedulers = all_schedulers()
+            for name, state in data.get('schedulers', {}).items():
+                if name in schedulers:
+                    restored_instances += schedulers[name].import_state(state)
+        restored_entries = self.cache.import_entries([tuple(entry) for entry in data.get('cache', [])])
+        self.last_load = {
+            'saved_at': saved_at,
+            'age': round(age, 1),
+            'instances': restored_instances,
+            'entries': restored_entries
+        }
+        logging.info(f"スナップショットを読み込みました: インスタンス{restored_instances}件, "
+                     f"キャッシュ{restored_entries}件 ({int(age)}秒前)")
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.save()
+
+    def start(self):
+        """読み込み後、定期保存スレッドを開始して終了時の保存を登録"""
+        if self._thread is not None:
+            return
+        self.load()
+        self._thread = threading.Thread(target=self._run, name='warm-snapshot', daemon=True)
+        self._thread.start()
+        atexit.register(self.save)
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        return {
+            'path': self.path,
+            'leader': self.is_leader,
+            'pid': os.getpid(),
+            'interval': self.interval,
+            'last_save': self.last_save,
+            'last_load': self.last_load
+        }
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def start_warm_snapshot():
+    """プロセスで1つのスナップショット管理を開始"""
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = WarmSnapshot()
+            _snapshot.start()
+        return _snapshot
+
+
+def get_warm_snapshot():
+    return _snapshot
@@ -0,0 +1,115 @@
+"""
+yt-dlp抽出処理 - 抽出用プロセスの中で実行される部分
+
+ワーカープロセスが読み込むため、キャッシュやHTTPセッションなど親プロセス側のモジュールは読み込まない。
+"""
+import logging
+from ytdl_pool import YtdlPool
+
+# 最適化されたyt-dlp設定（フォーマット指定はプールから借りるときに決める）
+EXTRACT_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': False,
+    'noplaylist': True,
+    'socket_timeout': 30,
+    'retries': 3,
+    'fragment_retries': 3,
+    'extractor_retries': 3,
+    'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+EXTRACT_FORMAT = 'best[height<=1080]/best'
+
+# yt_dlpは最初の抽出で読み込まれる（プロセス毎に1つ）
+ytdl_pool = YtdlPool(EXTRACT_OPTIONS)
+
+
+def extract_stream_data(video_id):
+    """yt-dlpでストリームURLを抽出（失敗時はyt-dlpの例外をそのまま送出）"""
+    url = f"https://www.youtube.com/watch?v={video_id}"
+    logging.info(f"動画URL取得開始: {video_id}")
+
+    with ytdl_pool.acquire(EXTRACT_FORMAT) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    if not info:
+        return None
+
+    formats = []
+    available_qualities = set()
+
+    # 利用可能なフォーマットを収集
+    for fmt in info.get('formats', []):
+        if not fmt.get('url') or not fmt.get('height'):
+            continue
+
+        height = fmt.get('height')
+        if height < 240:  # 240p未満は除外
+            continue
+
+        quality = f"{height}p"
+
+        # 重複を避ける
+        if quality in available_qualities:
+            continue
+
+        available_qualities.add(quality)
+
+        formats.append({
+            'url': fmt['url'],
+            'quality': quality,
+            'resolution': f"{fmt.get('width', '?')}x{height}",
+            'has_audio': fmt.get('acodec', 'none') != 'none',
+            'audio_url': None,
+            'bitrate': fmt.get('tbr', 0),
+            'fps': fmt.get('fps', 30),
+            'ext': fmt.get('ext', 'mp4')
+        })
+
+    # 品質でソート（高品質から低品質へ）
+    formats.sort(key=lambda x: int(x['quality'].replace('p', '')), reverse=True)
+
+    # 音声のみのフォーマットを同じ抽出結果から選ぶ（2回目の抽出はしない）
+    audio_url = select_audio_url(info.get('formats', []))
+
+    # 音声が分離されている場合は音声URLを追加
+    for fmt in formats:
+        if not fmt['has_audio'] and audio_url:
+            fmt['audio_url'] = audio_url
+
+    # フォールバック：基本的な品質オプションを保証
+    if not formats:
+        basic_url = info.get('url')
+        if basic_url:
+            formats = [{
+                'url': basic_url,
+                'quality': '720p',
+                'resolution': '1280x720',
+                'has_audio': True,
+                'audio_url': None,
+                'bitrate': 0,
+                'fps': 30,
+                'ext': 'mp4'
+            }]
+
+    return {
+        'title': info.get('title', ''),
+        'duration': info.get('duration', 0),
+        'thumbnail': info.get('thumbnail', ''),
+        'uploader': info.get('uploader', ''),
+        'best_url': formats[0]['url'] if formats else None,
+        'audio_url': audio_url,
+        'formats': formats
+    }
+
+
+def select_audio_url(formats):
+    """音声のみのフォーマットから最良のURLを選ぶ（'bestaudio[ext=m4a]/bestaudio' 相当）"""
+    # yt-dlpのformatsは低品質から高品質の順に並んでいる
+    audio_formats = [
+        fmt for fmt in formats
+        if fmt.get('url') and fmt.get('vcodec') == 'none' and fmt.get('acodec', 'none') != 'none'
+    ]
+    m4a_formats = [fmt for fmt in audio_formats if fmt.get('ext') == 'm4a']
+    candidates = m4a_formats or audio_formats
+    return candidates[-1]['url'] if candidates else None
@@ -0,0 +1,101 @@
+"""
+YoutubeDLプール - 初期化済みのYoutubeDLをフォーマット指定毎に使い回す
+
+yt_dlpは読み込みが重く、フォールバックでしか使わないため、最初にYoutubeDLを作るときに読み込む。
+YoutubeDLは抽出器やプレイヤーJSの解析結果を内部に持つので、使い回すと2回目以降の抽出が速くなる。
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from config import YTDL_POOL_SIZE, YTDL_POOL_MAX_USES
+
+_yt_dlp = None
+_import_lock = threading.Lock()
+
+
+def import_yt_dlp():
+    """yt_dlpを初回だけ読み込んで返す"""
+    global _yt_dlp
+    if _yt_dlp is None:
+        with _import_lock:
+            if _yt_dlp is None:
+                import yt_dlp
+                _yt_dlp = yt_dlp
+    return _yt_dlp
+
+
+def _close(ydl):
+    close = getattr(ydl, 'close', None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception as e:
+        logging.debug(f"YoutubeDLの終了に失敗: {e}")
+
+
+class YtdlPool:
+    def __init__(self, base_options, size=YTDL_POOL_SIZE, max_uses=YTDL_POOL_MAX_USES):
+        self.base_options = dict(base_options)
+        self.size = size
+        self.max_uses = max_uses
+        self._idle = {}  # フォーマット指定 -> [(YoutubeDL, 使用回数)]
+        self._lock = threading.Lock()
+        self._created = 0
+        self._reused = 0
+        self._discarded = 0
+
+    def _take(self, format_selector):
+        with self._lock:
+            idle = self._idle.get(format_selector)
+            if idle:
+                self._reused += 1
+                return idle.pop()
+            self._created += 1
+        yt_dlp = import_yt_dlp()
+        return yt_dlp.YoutubeDL({**self.base_options, 'format': format_selector}), 0
+
+    def _give_back(self, format_selector, ydl, uses):
+        with self._lock:
+            idle = self._idle.setdefault(format_selector, [])
+            if uses < self.max_uses and len(idle) < self.size:
+                idle.append((ydl, uses))
+                return
+            self._discarded += 1
+        _close(ydl)
+
+    @contextmanager
+    def acquire(self, format_selector):
+        """YoutubeDLを1つ借りる（同時に使うのは1スレッドだけ）
+
+        抽出中に例外が起きたインスタンスは状態を信用せず、プールに戻さず破棄する。
+        """
+        ydl, uses = self._take(format_selector)
+        healthy = False
+        try:
+            yield ydl
+            healthy = True
+        finally:
+            if healthy:
+                self._give_back(format_selector, ydl, uses + 1)
+            else:
+                with self._lock:
+                    self._discarded += 1
+                _close(ydl)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for entries in idle.values():
+            for ydl, _ in entries:
+                _close(ydl)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'yt_dlp_loaded': _yt_dlp is not None,
+                'idle': {format_selector: len(entries) for format_selector, entries in self._idle.items()},
+                'created': self._created,
+                'reused': self._reused,
+                'discarded': self._discarded
+            }
@@ -1,131 +1,116 @@
-import requests
 import logging
-import yt_dlp
-import subprocess
-import json
-from config import YTDL_OPTIONS
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from config import (YTDL_OPTIONS, YTDL_EXTRACT_WORKERS, YTDL_EXTRACT_QUEUE_SIZE, YTDL_EXTRACT_TIMEOUT,
+                    YTDL_EXTRACT_MAX_JOBS)
+from negative_cache import negative_cache, classify_unavailable_message
+from deadline import DeadlineExceeded
+from stream_cache import stream_cache
+from process_pool import ProcessPool, PoolQueueFull, RemoteJobError
+from ytdl_extractor import extract_stream_data
+
+# yt-dlpの抽出はCPU負荷が高いため別プロセスで実行する（プロセスは最初の抽出で起動）
+extraction_pool = ProcessPool(
+    'ytdl-extract', extract_stream_data,
+    workers=YTDL_EXTRACT_WORKERS,
+    queue_size=YTDL_EXTRACT_QUEUE_SIZE,
+    job_timeout=YTDL_EXTRACT_TIMEOUT,
+    max_jobs=YTDL_EXTRACT_MAX_JOBS
+)
 
 
 class YtdlService:
     def __init__(self):
         self.node_service_url = "http://localhost:3001"
         self.ytdl_opts = YTDL_OPTIONS.copy()
-    
-    def get_stream_urls(self, video_id):
-        """シンプルで確実な動画取得"""
+        self._in_flight = {}  # 動画ID -> 実行中の抽出のFuture
+        self._lock = threading.Lock()
+        self._executed = 0
+        self._coalesced = 0
+
+    def get_stream_urls(self, video_id, deadline=None):
+        """シンプルで確実な動画取得（同じ動画の同時抽出は1回にまとめる）
+
+        deadlineを渡すと残り時間だけ待ち、過ぎたらDeadlineExceededを送出する。
+        """
+        # 再生できないと分かっている動画は抽出しない
+        if negative_cache.get('video', video_id):
+            return None
+        # URLが失効するまでは前回の抽出結果を使う
+        cached_streams = stream_cache.get('ytdl', video_id)
+        if cached_streams is not None:
+            return cached_streams
+
+        future = self.extract_async(video_id)
         try:
-            url = f"https://www.youtube.com/watch?v={video_id}"
-            logging.info(f"動画URL取得開始: {video_id}")
-            
-            # 最適化されたyt-dlp設定
-            opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': False,
-                'format': 'best[height<=1080]/best',
-                'noplaylist': True,
-                'socket_timeout': 30,
-                'retries': 3,
-                'fragment_retries': 3,
-                'extractor_retries': 3,
-                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                if not info:
-                    return None
-                
-                formats = []
-                available_qualities = set()
-                
-                # 利用可能なフォーマットを収集
-                for fmt in info.get('formats', []):
-                    if not fmt.get('url') or not fmt.get('height'):
-                        continue
-                    
-                    height = fmt.get('height')
-                    if height < 240:  # 240p未満は除外
-                        continue
-                        
-                    quality = f"{height}p"
-                    
-                    # 重複を避ける
-                    if quality in available_qualities:
-                        continue
-                    
-                    available_qualities.add(quality)
-                    
-                    formats.append({
-                        'url': fmt['url'],
-                        'quality': quality,
-                        'resolution': f"{fmt.get('width', '?')}x{height}",
-                        'has_audio': fmt.get('acodec', 'none') != 'none',
-                        'audio_url': None,
-                        'bitrate': fmt.get('tbr', 0),
-                        'fps': fmt.get('fps', 30),
-                        'ext': fmt.get('ext', 'mp4')
-                    })
-                
-                # 品質でソート（高品質から低品質へ）
-                formats.sort(key=lambda x: int(x['quality'].replace('p', '')), reverse=True)
-                
-                # 音声のみのフォーマットを取得
-                audio_url = self._get_audio_stream(video_id)
-                
-                # 音声が分離されている場合は音声URLを追加
-                for fmt in formats:
-                    if not fmt['has_audio'] and audio_url:
-                        fmt['audio_url'] = audio_url
-                
-                # フォールバック：基本的な品質オプションを保証
-                if not formats:
-                    basic_url = info.get('url')
-                    if basic_url:
-                        formats = [{
-                            'url': basic_url,
-                            'quality': '720p',
-                            'resolution': '1280x720',
-                            'has_audio': True,
-                            'audio_url': None,
-                            'bitrate': 0,
-                            'fps': 30,
-                            'ext': 'mp4'
-                        }]
-                
-                return {
-                    'title': info.get('title', ''),
-                    'duration': info.get('duration', 0),
-                    'thumbnail': info.get('thumbnail', ''),
-                    'uploader': info.get('uploader', ''),
-                    'best_url': formats[0]['url'] if formats else None,
-                    'formats': formats
-                }
-                
+            return future.result(timeout=deadline.timeout() if deadline is not None else None)
+        except FutureTimeoutError:
+            # 抽出は止めずに完了させ、結果はキャッシュに残す
+            raise DeadlineExceeded(f"yt-dlpの抽出が持ち時間内に終わりませんでした: {video_id}")
+
+    def extract_async(self, video_id):
+        """抽出をプロセスプールに投入してFutureを返す（結果はストリーム、取得できなければNone）
+
+        同じ動画の抽出が実行中ならそのFutureを共有する。待ち行列が満杯なら即座にNoneで完了する。
+        """
+        with self._lock:
+            future = self._in_flight.get(video_id)
+            if future is not None:
+                self._coalesced += 1
+                return future
+            future = self._in_flight[video_id] = Future()
+            self._executed += 1
+
+        try:
+            job = extraction_pool.submit(video_id)
+        except PoolQueueFull as e:
+            logging.warning(f"yt-dlpの抽出を断りました: {video_id}: {e}")
+            self._finish(video_id, future, None)
+            return future
+        job.add_done_callback(lambda job: self._on_extracted(video_id, future, job))
+        return future
+
+    def _on_extracted(self, video_id, future, job):
+        """抽出結果をストリームURLキャッシュに保存（持ち時間切れで待つのをやめた抽出の結果も残る）"""
+        stream_data = None
+        try:
+            stream_data = job.result()
         except Exception as e:
             logging.error(f"動画取得エラー: {e}")
-            return None
-    
-    def _get_audio_stream(self, video_id):
-        """音声ストリームを取得"""
-        try:
-            url = f"https://www.youtube.com/watch?v={video_id}"
-            opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'format': 'bestaudio[ext=m4a]/bestaudio',
-                'noplaylist': True
+            # 非公開・地域制限などの確定的なエラーのみ記録（ネットワークエラーやタイムアウトは記録しない）
+            reason = classify_unavailable_message(str(e)) if isinstance(e, RemoteJobError) else None
+            if reason:
+                negative_cache.record('video', video_id, reason)
+        else:
+            if stream_data:
+                stream_cache.set('ytdl', video_id, stream_data)
+        self._finish(video_id, future, stream_data)
+
+    def _finish(self, video_id, future, stream_data):
+        with self._lock:
+            self._in_flight.pop(video_id, None)
+        future.set_result(stream_data)
+
+    def coalescing_stats(self):
+        """同じ動画の同時抽出の合流件数（SingleFlightの統計と同じ形）"""
+        with self._lock:
+            return {
+                'executed': self._executed,
+                'coalesced': self._coalesced,
+                'in_flight': len(self._in_flight)
             }
-            
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                return info.get('url') if info else None
-                
+
+    def stats(self):
+        return {
+            **self.coalescing_stats(),
+            'process_pool': extraction_pool.stats()
+        }
+
+    def get_audio_url(self, video_id):
+        """音声のみのURLを取得（互換性のため、動画と同じ抽出結果を使う）"""
+        try:
+            stream_data = self.get_stream_urls(video_id)
+            return stream_data.get('audio_url') if stream_data else None
         except Exception as e:
             logging.error(f"音声取得エラー: {e}")
             return None
-    
-    def get_audio_url(self, video_id):
-        """音声のみのURLを取得（互換性のため）"""
-        return self._get_audio_stream(video_id)
\ No newline at end of file